@@ -1,23 +1,112 @@
 import numpy as np
 import random
+import sys
 import math
 import matplotlib.pyplot as plt
 import csv
+import itertools
+import json
+import os
 import yaml
-
+import bisect
+import time
+import hashlib
+import re
+import sqlite3
+from collections import OrderedDict
+
+# Bucket state is kept in __slots__ and typed arrays sized like the hardware: bool arrays (one byte per bit, indexed
+# directly by the vectorized updates) for the bit-arrays of the distinct and Bloom buckets and 32-bit counters for the
+# counting Bloom filter and the fine-grained histogram
 class Bucket:
+  __slots__ = ('low', 'high', 'count', 'is_configured', 'LUT', 'FF', 'BRAM', 'DSP')
+
+  # Synthesized variants: size -> (constructor arguments, (LUTs, FFs, BRAM, DSPs)). The last constructor argument is
+  # the size parameter of the variant (bit-array length, filter or sub-bucket address bits).
+  variants = {}
+  # VHDL entity of the bucket and the generics matching its constructor arguments
+  hw_module = None
+  generics = ()
+  # Legal values of each generic, explored by register_generic_space
+  generic_space = ()
+  # Coefficients (features x 4) of the fitted resource model, see fit_resource_model
+  resource_model = None
+  # Feature directions its observations do not determine and the feature scale, see resource_model_covers
+  resource_model_null = None
+  # Incremented whenever any bucket is configured, histograms rebuild their bucket index when it changed
+  layout_version = 0
+
   def __init__(self):
     self.low = 0
     self.high = 0
     self.count = 0
     self.is_configured = False
 
+  @classmethod
+  def create_default_bucket(cls, size):
+    return cls(*cls.variants[size][0])
+
+  @classmethod
+  def get_resources_of_bucket(cls, size):
+    return cls.variants[size][1]
+
+  # Resources of the smallest variant whose size parameter covers the given one, of the largest variant otherwise
+  @classmethod
+  def resources_of_parameter(cls, parameter):
+    ordered = sorted(cls.variants.values(), key=lambda variant: variant[0][-1])
+    for args, resources in ordered:
+      if parameter <= args[-1]:
+        return resources
+    return ordered[-1][1]
+
+  # Resources of the registered variant with the given constructor arguments, see resources_of_parameter otherwise
+  @classmethod
+  def resources_of_arguments(cls, args):
+    for variant_args, resources in cls.variants.values():
+      if variant_args == args:
+        return resources
+    return cls.resources_of_parameter(args[-1])
+
+  # RMSE over a segment with the given segment_statistics predicted without simulating the bucket, None for types
+  # without an error model
+  @classmethod
+  def predicted_rmse(cls, args, statistics):
+    return None
+
+  # Regressors of the resource model for the given constructor arguments
+  @classmethod
+  def resource_features(cls, args):
+    return [1.0]
+
+  # Whether the resource model determines the resources at these arguments: features that differ from the observed
+  # ones along a direction no observation varies (e.g. a hash count all observations share) have arbitrary predictions
+  @classmethod
+  def resource_model_covers(cls, args):
+    if cls.resource_model is None:
+      return False
+    directions, scale = cls.resource_model_null
+    # Scaled features of the observations are at most 1, far larger ones must not hide a deviation along the null space
+    features = np.asarray(cls.resource_features(args), dtype=np.float64) / scale
+    return np.linalg.norm(features @ directions) <= 1e-6
+
+  # Resources of a variant with the given constructor arguments predicted by the resource model
+  @classmethod
+  def estimate_resources(cls, args):
+    if cls.resource_model is None:
+      raise ValueError(f"No resource model fitted for {cls.__name__}")
+    if not cls.resource_model_covers(args):
+      raise ValueError(f"The resource model of {cls.__name__} does not determine the resources of {tuple(args)}, no observation varies the features they differ in")
+    LUT, FF, BRAM, DSP = np.maximum(np.dot(cls.resource_features(args), cls.resource_model), 0).tolist()
+    # BRAM is allocated in RAMB18 halves of a tile
+    return (int(round(LUT)), int(round(FF)), math.ceil(BRAM * 2) / 2, int(round(DSP)))
+
   def config(self, low, high):
     if self.is_configured == False:
       self.low = low
       self.high = high
       self.count = 0
       self.is_configured = True
+      Bucket.layout_version += 1
 
   def update(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
@@ -29,31 +118,105 @@ class Bucket:
     else:
       return 0
 
+  # Values of [low, high) in their original order
+  def values_in_range(self, values):
+    values = np.asarray(values, dtype=np.int64)
+    if self.is_configured == False:
+      return values[:0]
+    return values[(values >= self.low) & (values < self.high)]
+
+  # Same as calling update for each value in order
+  def update_many(self, values):
+    self.count += len(self.values_in_range(values))
+
+  def counts_in_range(self, values, counts):
+    values = np.asarray(values, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    if self.is_configured == False:
+      return values[:0], counts[:0]
+    mask = (values >= self.low) & (values < self.high) & (counts > 0)
+    return values[mask], counts[mask]
+
+  # Bulk equivalent of calling update(val) counts[i] times for every values[i], in ascending value order
+  def load_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    self.count += int(counts.sum())
+
+  # Raw hashes of the segment shared between candidate buckets, only the Bloom buckets hash values
+  def use_hashes(self, range_hashes):
+    pass
+
+  # read(val) for every val in [low, high)
+  def estimate_array(self):
+    if self.is_configured == False:
+      return np.zeros(0, dtype=np.int64)
+    return np.full(self.high - self.low, self.count, dtype=np.int64)
+
+  # Sum of read(val) ** 2 over [low, high)
+  def squared_estimate_total(self):
+    if self.is_configured == False:
+      return 0
+    return (self.high - self.low) * self.count * self.count
+
+  # read(val) for every val in values
+  def read_many(self, values):
+    return np.array([self.read(val) for val in np.asarray(values, dtype=np.int64).tolist()], dtype=np.int64)
+
+  # Sum of squared errors over [low, high) against a ground truth given by its non-zero (values, counts)
+  def sse_of_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    return self.squared_estimate_total() + int(np.dot(counts, counts - 2 * self.read_many(values)))
+
+  # Clock cycles before the bucket accepts the sample following each update of the stream. Every sample passes through
+  # every bucket of the chain, whether it is in [low, high) or not.
+  def stream_cycles(self, values):
+    return np.full(len(values), self.initiation_interval, dtype=np.int64)
+
   def display_info(self):
     print(f"[low: {self.low}, high: {self.high}, count: {self.count}]")
 
 
+def constant_estimate_sse(estimate, width, counts):
+  total = int(counts.sum())
+  squares = int(np.dot(counts, counts))
+  return width * estimate * estimate - 2 * estimate * total + squares
+
+def rmse_of_sse(sse, width):
+  return math.sqrt(max(sse, 0) / width)
+
+# Probability that a value hits num_hashes set bits of a filter of filter_size bits holding distinct values
+def bloom_false_positive_rate(num_hashes, filter_size, distinct):
+  return (-np.expm1(-num_hashes * np.asarray(distinct, dtype=np.float64) / filter_size)) ** num_hashes
+
+
 class CoarseGrainedSimpleBucket(Bucket):
-  resources = (193, 301, 0, 0) # (LUTs, FFs, BRAM, DSPs)
+  __slots__ = ()
+
+  variants = {
+    'S': ((), (193, 301, 0, 0)),
+  }
+  hw_module = 'CoarseGrainedBucket'
   latency = 1 # clock cycles
+  initiation_interval = 1 # clock cycles between two accepted samples
 
   def __init__(self):
     super().__init__()
-    self.LUT = 193
-    self.FF = 301
-    self.BRAM = 0
-    self.DSP = 0
+    (self.LUT, self.FF, self.BRAM, self.DSP) = self.variants['S'][1]
 
   def get_resource_consumption(self):
     return (self.LUT, self.FF, self.BRAM, self.DSP)
 
-  @classmethod
-  def create_default_bucket(cls, size):
-    return CoarseGrainedSimpleBucket()
+  def sse_of_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    if self.is_configured == False:
+      return 0
+    return constant_estimate_sse(self.count, self.high - self.low, counts)
 
+  # Exact: every value reads the total count
   @classmethod
-  def get_resources_of_bucket(cls, size):
-    return cls.resources
+  def predicted_rmse(cls, args, statistics):
+    width, total, distinct, squares = statistics
+    return rmse_of_sse(width * total * total - 2 * total * total + squares, width)
 
   def avg_resource_usage(self, available_budget=None):
     if available_budget == None:
@@ -74,24 +237,27 @@ class CoarseGrainedSimpleBucket(Bucket):
     return (wLUT * LUT + wFF * FF + wBRAM * BRAM + wDSP * DSP) / total_res
 
 class CoarseGrainedDistinctBucket(Bucket):
-  resources_S = (1489, 403, 0, 30) # (LUTs, FFs, BRAM, DSPs) for 64-bit bit-array
-  resources_M = (1815, 595, 0, 30) # (LUTs, FFs, BRAM, DSPs) for 256-bit bit-array
-  resources_L = (2105, 851, 0, 30) # (LUTs, FFs, BRAM, DSPs) for 512-bit bit-array
+  __slots__ = ('distinct_count', 'max_distincts', 'distincts')
+
+  variants = {
+    'S': ((64,), (1489, 403, 0, 30)), # 64-bit bit-array
+    'M': ((256,), (1815, 595, 0, 30)), # 256-bit bit-array
+    'L': ((512,), (2105, 851, 0, 30)), # 512-bit bit-array
+  }
+  hw_module = 'CoarseGrainedDistinctBucket'
+  generics = ('MAX_BUCKET_SIZE',)
+  # The bit-array is addressed by the low bits of the value
+  generic_space = ([2 ** bits for bits in range(1, 17)],)
 
   latency = 1 # clock cycles
+  initiation_interval = 1 # clock cycles between two accepted samples
 
   def __init__(self, max_distincts):
     super().__init__()
     self.distinct_count = 0
     self.max_distincts = max_distincts
-    self.distincts = [0] * self.max_distincts
-
-    if max_distincts <= 64:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_S
-    elif max_distincts <= 256:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_M
-    else:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_L
+    self.distincts = np.zeros(self.max_distincts, dtype=bool)
+    (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_of_arguments((max_distincts,))
 
   def config(self, low, high):
     if self.is_configured == False:
@@ -99,36 +265,70 @@ class CoarseGrainedDistinctBucket(Bucket):
       self.high = high
       self.count = 0
       self.distinct_count = 0
-      self.distincts = [0] * self.max_distincts
+      self.distincts = np.zeros(self.max_distincts, dtype=bool)
       self.is_configured = True
+      Bucket.layout_version += 1
 
   def update(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
       self.count += 1
-      if self.distincts[val % self.max_distincts] == 0:
+      if self.distincts[val % self.max_distincts] == False:
         self.distinct_count += 1
-        self.distincts[val % self.max_distincts] = 1
+        self.distincts[val % self.max_distincts] = True
+
+  def mark_distincts(self, values):
+    slots = np.unique(values % self.max_distincts)
+    new_slots = slots[~self.distincts[slots]]
+    self.distinct_count += len(new_slots)
+    self.distincts[new_slots] = True
+
+  # The bit-array only records which slots were seen, so the order of the values does not matter
+  def update_many(self, values):
+    values = self.values_in_range(values)
+    self.count += len(values)
+    self.mark_distincts(values)
+
+  def load_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    self.count += int(counts.sum())
+    self.mark_distincts(values)
+
+  def estimate(self):
+    if self.distinct_count > 0:
+      return int(self.count / self.distinct_count)
+    return 0
+
+  def estimate_array(self):
+    if self.is_configured == False:
+      return np.zeros(0, dtype=np.int64)
+    return np.full(self.high - self.low, self.estimate(), dtype=np.int64)
+
+  def sse_of_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    if self.is_configured == False:
+      return 0
+    return constant_estimate_sse(self.estimate(), self.high - self.low, counts)
 
   def get_resource_consumption(self):
     return (self.LUT, self.FF, self.BRAM, self.DSP)
 
+  # Bit-array length
   @classmethod
-  def get_resources_of_bucket(cls, size):
-    if size == 'S':
-      return cls.resources_S
-    elif size == 'M':
-      return cls.resources_M
-    else:
-      return cls.resources_L
+  def resource_features(cls, args):
+    max_distincts, = args
+    return [1.0, max_distincts]
 
+  # Distinct values folded onto the bit-array slots like balls into bins, exact when the segment fits in the bit-array
   @classmethod
-  def create_default_bucket(cls, size):
-    if size == 'S':
-      return CoarseGrainedDistinctBucket(64)
-    elif size == 'M':
-      return CoarseGrainedDistinctBucket(256)
+  def predicted_rmse(cls, args, statistics):
+    max_distincts, = args
+    width, total, distinct, squares = statistics
+    if width <= max_distincts:
+      occupied = distinct
     else:
-      return CoarseGrainedDistinctBucket(512)
+      occupied = max_distincts * -math.expm1(-distinct / max_distincts)
+    estimate = int(total / occupied) if occupied > 0 else 0
+    return rmse_of_sse(width * estimate * estimate - 2 * estimate * total + squares, width)
 
   def avg_resource_usage(self, available_budget=None):
     if available_budget == None:
@@ -188,15 +388,78 @@ def murmur3(key: int, seed: int) -> int:
 
     return h
 
+# murmur3 of every key for every seed, as a (len(seeds), len(keys)) uint32 array bit-identical to murmur3(key, seed)
+def murmur3_many(keys, seeds):
+  k = (np.asarray(keys, dtype=np.int64) & 0xFFFFFFFF).astype(np.uint32)
+  h = np.asarray(seeds, dtype=np.uint32)[:, np.newaxis]
+
+  k = k * np.uint32(0xcc9e2d51)
+  k = (k << np.uint32(15)) | (k >> np.uint32(17))
+  k = k * np.uint32(0x1b873593)
+
+  h = h ^ k
+  h = (h << np.uint32(13)) | (h >> np.uint32(19))
+  h = h * np.uint32(5) + np.uint32(0xe6546b64)
+
+  h ^= np.uint32(4)
+  h ^= h >> np.uint32(16)
+  h *= np.uint32(0x85ebca6b)
+  h ^= h >> np.uint32(13)
+  h *= np.uint32(0xc2b2ae35)
+  h ^= h >> np.uint32(16)
+
+  return h
+
+# Batch form of the sequential Bloom filter insertion: value i (column i of addresses) is new when one of its
+# addresses is neither set beforehand nor set by one of the values 0..i-1
+def first_insertions(is_set, addresses):
+  num_values = addresses.shape[1]
+  order = np.broadcast_to(np.arange(num_values), addresses.shape)
+  first_setter = np.full(len(is_set), num_values)
+  np.minimum.at(first_setter, addresses, order)
+  return np.any(~is_set[addresses] & (first_setter[addresses] == order), axis=0)
+
+# Raw 32-bit murmur3 of every value of [low, high), computed once per seed and shared by all Bloom buckets of the
+# segment. Filter sizes are powers of two, so each bucket derives its addresses by masking the raw hashes.
+class RangeHashes:
+  def __init__(self, low, high):
+    self.low = low
+    self.high = high
+    self.raw = {}
+
+  def covers(self, low, high):
+    return self.low <= low and high <= self.high
+
+  def raw_hashes(self, seeds):
+    seeds = tuple(seeds)
+    if seeds not in self.raw:
+      self.raw[seeds] = murmur3_many(np.arange(self.low, self.high), seeds)
+    return self.raw[seeds]
+
+  # values=None stands for all of [low, high)
+  def addresses(self, values, low, high, seeds, filter_size):
+    if values is None:
+      raw = self.raw_hashes(seeds)[:, low - self.low:high - self.low]
+    else:
+      raw = self.raw_hashes(seeds)[:, np.asarray(values, dtype=np.int64) - self.low]
+    return raw & np.uint32(filter_size - 1)
+
 class CoarseGrainedBloomBucket(Bucket):
+  __slots__ = ('distinct_count', 'num_hashes', 'filter_size_bits', 'filter_size', 'bloom_filter', 'range_hashes')
 
   seeds = [0x92d6a354, 0x8bf65351, 0x960b7a1f, 0x9d670b00, 0xb32d6bd1]
 
-  resources_S = (1729, 349, 0, 30) # (LUTs, FFs, BRAM, DSPs) for 2 ** 4 = 16
-  resources_M = (2892, 589, 0, 30) # (LUTs, FFs, BRAM, DSPs) for 2 ** 8 = 256
-  resources_L = (6198, 1357, 0, 30) # (LUTs, FFs, BRAM, DSPs) for 2 ** 10 = 1024
+  variants = {
+    'S': ((3, 4), (1729, 349, 0, 30)), # 3 hashes, 2 ** 4 = 16 bits
+    'M': ((3, 8), (2892, 589, 0, 30)), # 3 hashes, 2 ** 8 = 256 bits
+    'L': ((3, 10), (6198, 1357, 0, 30)), # 3 hashes, 2 ** 10 = 1024 bits
+  }
+  hw_module = 'BloomFilterBucket'
+  generics = ('NUM_HASHES', 'FILTER_SIZE_BITS')
+  generic_space = (range(3, 6), range(1, 33))
 
   latency = 1 # clock cycles
+  initiation_interval = 1 # clock cycles between two accepted samples
 
   def __init__(self, num_hashes, filter_size_bits):
     super().__init__()
@@ -205,14 +468,9 @@ class CoarseGrainedBloomBucket(Bucket):
     self.num_hashes = num_hashes
     self.filter_size_bits = filter_size_bits
     self.filter_size = 2 ** filter_size_bits
-    self.bloom_filter = [False] * self.filter_size
-
-    if filter_size_bits <= 4:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_S
-    elif filter_size_bits <= 8:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_M
-    else:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_L
+    self.bloom_filter = np.zeros(self.filter_size, dtype=bool)
+    self.range_hashes = None
+    (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_of_arguments((num_hashes, filter_size_bits))
 
   def config(self, low, high):
     if self.is_configured == False:
@@ -221,7 +479,8 @@ class CoarseGrainedBloomBucket(Bucket):
       self.count = 0
       self.distinct_count = 0
       self.is_configured = True
-      self.bloom_filter = [False] * self.filter_size
+      Bucket.layout_version += 1
+      self.bloom_filter = np.zeros(self.filter_size, dtype=bool)
 
   def update(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
@@ -240,6 +499,35 @@ class CoarseGrainedBloomBucket(Bucket):
       if query == False:
         self.distinct_count += 1
 
+  def use_hashes(self, range_hashes):
+    self.range_hashes = range_hashes
+
+  # (num_hashes, len(values)) filter addresses of the values of [low, high), values=None stands for all of them
+  def hash_addresses(self, values=None):
+    seeds = self.seeds[:self.num_hashes]
+    if self.range_hashes is not None and self.range_hashes.covers(self.low, self.high):
+      return self.range_hashes.addresses(values, self.low, self.high, seeds, self.filter_size)
+    if values is None:
+      values = np.arange(self.low, self.high)
+    return murmur3_many(values, seeds) & np.uint32(self.filter_size - 1)
+
+  # Same as calling update for each value in order
+  def update_many(self, values):
+    if self.is_configured == False:
+      return
+    values = self.values_in_range(values)
+    addresses = self.hash_addresses(values)
+
+    self.count += len(values)
+    self.distinct_count += int(np.count_nonzero(first_insertions(self.bloom_filter, addresses)))
+    self.bloom_filter[addresses.ravel()] = True
+
+  # Only the first occurrence of a value can set new bits, the remaining ones just increment the count
+  def load_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    self.update_many(values)
+    self.count += int(counts.sum()) - len(values)
+
   def read(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
       query = True
@@ -257,26 +545,54 @@ class CoarseGrainedBloomBucket(Bucket):
     else:
       return 0
 
+  # Same as read for each value
+  def read_many(self, values):
+    values = np.asarray(values, dtype=np.int64)
+    estimates = np.zeros(len(values), dtype=np.int64)
+    if self.is_configured == False:
+      return estimates
+
+    in_range = (values >= self.low) & (values < self.high)
+    estimates[in_range] = self.estimates_of_addresses(self.hash_addresses(values[in_range]))
+    return estimates
+
+  def estimates_of_addresses(self, addresses):
+    estimates = np.zeros(addresses.shape[1], dtype=np.int64)
+    present = np.all(self.bloom_filter[addresses], axis=0)
+    if np.any(present):
+      estimates[present] = int(self.count / self.distinct_count)
+    return estimates
+
+  def estimate_array(self):
+    if self.is_configured == False:
+      return np.zeros(0, dtype=np.int64)
+    return self.estimates_of_addresses(self.hash_addresses())
+
+  def squared_estimate_total(self):
+    estimates = self.estimate_array()
+    return int(np.dot(estimates, estimates))
+
   def get_resource_consumption(self):
     return (self.LUT, self.FF, self.BRAM, self.DSP)
 
+  # One Murmur3 unit per hash, filter bits
   @classmethod
-  def get_resources_of_bucket(cls, size):
-    if size == 'S':
-      return cls.resources_S
-    elif size == 'M':
-      return cls.resources_M
-    else:
-      return cls.resources_L
+  def resource_features(cls, args):
+    num_hashes, filter_size_bits = args
+    return [1.0, num_hashes, 2 ** filter_size_bits]
 
+  # Present values read count / distinct_count, absent ones too when they are false positives. Insertions that are
+  # false positives themselves are not counted as distinct.
   @classmethod
-  def create_default_bucket(cls, size):
-    if size == 'S':
-      return CoarseGrainedBloomBucket(3, 4)
-    elif size == 'M':
-      return CoarseGrainedBloomBucket(3, 8)
-    else:
-      return CoarseGrainedBloomBucket(3, 10)
+  def predicted_rmse(cls, args, statistics):
+    num_hashes, filter_size_bits = args
+    width, total, distinct, squares = statistics
+    filter_size = 2 ** filter_size_bits
+    counted = distinct * (1 - float(np.mean(bloom_false_positive_rate(num_hashes, filter_size, np.linspace(0, distinct, 17)))))
+    estimate = int(total / counted) if counted > 0 else 0
+    false_positives = (width - distinct) * float(bloom_false_positive_rate(num_hashes, filter_size, distinct))
+    sse = squares - 2 * estimate * total + (distinct + false_positives) * estimate * estimate
+    return rmse_of_sse(sse, width)
 
   def avg_resource_usage(self, available_budget=None):
     if available_budget == None:
@@ -300,14 +616,21 @@ class CoarseGrainedBloomBucket(Bucket):
     print(f"[low: {self.low}, high: {self.high}, count: {self.count}, distinct count: {self.distinct_count}]")
 
 class CoarseGrainedCountingBloomBucket(Bucket):
+  __slots__ = ('distinct_count', 'num_hashes', 'filter_size_bits', 'filter_size', 'counting_bloom_filter', 'range_hashes')
 
   seeds = [0x92d6a354, 0x8bf65351, 0x960b7a1f, 0x9d670b00, 0xb32d6bd1]
 
-  resources_S = (2665, 1325, 0, 24) # (LUTs, FFs, BRAM, DSPs) for 2 ** 5
-  resources_M = (16438, 8493, 0, 24) # (LUTs, FFs, BRAM, DSPs) for 2 ** 8
-  resources_L = (66979, 33069, 0, 24) # (LUTs, FFs, BRAM, DSPs) for 2 ** 10
+  variants = {
+    'S': ((3, 5), (2665, 1325, 0, 24)), # 3 hashes, 2 ** 5 counters
+    'M': ((3, 8), (16438, 8493, 0, 24)), # 3 hashes, 2 ** 8 counters
+    'L': ((3, 10), (66979, 33069, 0, 24)), # 3 hashes, 2 ** 10 counters
+  }
+  hw_module = 'CountingBloomFilterBucket'
+  generics = ('NUM_HASHES', 'NUM_COUNTERS_BITS')
+  generic_space = (range(2, 6), range(1, 33))
 
   latency = 1 # clock cycles
+  initiation_interval = 1 # clock cycles between two accepted samples
 
   def __init__(self, num_hashes, filter_size_bits):
     super().__init__()
@@ -316,14 +639,9 @@ class CoarseGrainedCountingBloomBucket(Bucket):
     self.num_hashes = num_hashes
     self.filter_size_bits = filter_size_bits
     self.filter_size = 2 ** filter_size_bits
-    self.counting_bloom_filter = [0] * self.filter_size
-
-    if filter_size_bits <= 5:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_S
-    elif filter_size_bits <= 8:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_M
-    else:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_L
+    self.counting_bloom_filter = np.zeros(self.filter_size, dtype=np.uint32)
+    self.range_hashes = None
+    (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_of_arguments((num_hashes, filter_size_bits))
 
   def config(self, low, high):
     if self.is_configured == False:
@@ -332,7 +650,8 @@ class CoarseGrainedCountingBloomBucket(Bucket):
       self.count = 0
       self.distinct_count = 0
       self.is_configured = True
-      self.counting_bloom_filter = [0] * self.filter_size
+      Bucket.layout_version += 1
+      self.counting_bloom_filter = np.zeros(self.filter_size, dtype=np.uint32)
 
   def update(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
@@ -351,6 +670,46 @@ class CoarseGrainedCountingBloomBucket(Bucket):
       if query == False:
         self.distinct_count += 1
 
+  def use_hashes(self, range_hashes):
+    self.range_hashes = range_hashes
+
+  # (num_hashes, len(values)) filter addresses of the values of [low, high), values=None stands for all of them
+  def hash_addresses(self, values=None):
+    seeds = self.seeds[:self.num_hashes]
+    if self.range_hashes is not None and self.range_hashes.covers(self.low, self.high):
+      return self.range_hashes.addresses(values, self.low, self.high, seeds, self.filter_size)
+    if values is None:
+      values = np.arange(self.low, self.high)
+    return murmur3_many(values, seeds) & np.uint32(self.filter_size - 1)
+
+  # Adds each value counts[i] times, the distinct count only depends on the first occurrence
+  def insert_many(self, values, counts):
+    addresses = self.hash_addresses(values)
+
+    self.count += int(counts.sum())
+    self.distinct_count += int(np.count_nonzero(first_insertions(self.counting_bloom_filter != 0, addresses)))
+    np.add.at(self.counting_bloom_filter, addresses, np.broadcast_to(counts.astype(np.uint32), addresses.shape))
+
+  # Same as calling update for each value in order
+  def update_many(self, values):
+    if self.is_configured == False:
+      return
+    values = self.values_in_range(values)
+    self.insert_many(values, np.ones(len(values), dtype=np.int64))
+
+  def load_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    self.insert_many(values, counts)
+
+  def estimate_array(self):
+    if self.is_configured == False:
+      return np.zeros(0, dtype=np.int64)
+    return np.min(self.counting_bloom_filter[self.hash_addresses()], axis=0).astype(np.int64)
+
+  def squared_estimate_total(self):
+    estimates = self.estimate_array()
+    return int(np.dot(estimates, estimates))
+
   def read(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
       min_count = self.counting_bloom_filter[murmur3(val, self.seeds[0]) % self.filter_size]
@@ -360,31 +719,46 @@ class CoarseGrainedCountingBloomBucket(Bucket):
         if self.counting_bloom_filter[h] < min_count:
           min_count = self.counting_bloom_filter[h]
 
-      return min_count
+      return int(min_count)
 
     else:
       return 0
 
+  # Same as read for each value
+  def read_many(self, values):
+    values = np.asarray(values, dtype=np.int64)
+    estimates = np.zeros(len(values), dtype=np.int64)
+    if self.is_configured == False:
+      return estimates
+
+    in_range = (values >= self.low) & (values < self.high)
+    estimates[in_range] = np.min(self.counting_bloom_filter[self.hash_addresses(values[in_range])], axis=0)
+    return estimates
+
   def get_resource_consumption(self):
     return (self.LUT, self.FF, self.BRAM, self.DSP)
 
+  # One Murmur3 unit per hash, 32-bit counters
   @classmethod
-  def get_resources_of_bucket(cls, size):
-    if size == 'S':
-      return cls.resources_S
-    elif size == 'M':
-      return cls.resources_M
-    else:
-      return cls.resources_L
+  def resource_features(cls, args):
+    num_hashes, filter_size_bits = args
+    return [1.0, num_hashes, 2 ** filter_size_bits]
 
+  # A value is overestimated when all its counters are shared with other values, by the counts of the values that
+  # share its least loaded counter
   @classmethod
-  def create_default_bucket(cls, size):
-    if size == 'S':
-      return CoarseGrainedCountingBloomBucket(3, 5)
-    elif size == 'M':
-      return CoarseGrainedCountingBloomBucket(3, 8)
-    else:
-      return CoarseGrainedCountingBloomBucket(3, 10)
+  def predicted_rmse(cls, args, statistics):
+    num_hashes, filter_size_bits = args
+    width, total, distinct, squares = statistics
+    if distinct == 0:
+      return 0.0
+    filter_size = 2 ** filter_size_bits
+    collision = float(bloom_false_positive_rate(num_hashes, filter_size, distinct))
+    # Values sharing a counter that is shared at all
+    load = num_hashes * distinct / filter_size
+    sharing = load / -math.expm1(-load)
+    mean, second = total / distinct, squares / distinct
+    return rmse_of_sse(width * collision * (sharing * second + sharing * (sharing - 1) * mean * mean), width)
 
   def avg_resource_usage(self, available_budget=None):
     if available_budget == None:
@@ -419,13 +793,25 @@ def next_power_of_2(n):
   return n
 
 class FineGrainedBucket(Bucket):
-
-  resources_S = (678, 540, 0.5, 0) # (LUTs, FFs, BRAM, DSPs) for 2 ** 7 = 128
-  resources_M = (678, 540, 2, 0) # (LUTs, FFs, BRAM, DSPs) for 2 ** 11 = 2K
-  resources_L = (678, 540, 7.5, 0) # (LUTs, FFs, BRAM, DSPs) for 2 ** 13 = 8K
-  resources_XL = (678, 540, 50, 0) # (LUTs, FFs, BRAM, DSPs) for 2 ** 16 = 64K
+  __slots__ = ('msb_pos', 'num_sub_buckets_bits', 'num_sub_buckets', 'histogram')
+
+  variants = {
+    'S': ((7,), (678, 540, 0.5, 0)), # 2 ** 7 = 128 sub-buckets
+    'M': ((11,), (678, 540, 2, 0)), # 2 ** 11 = 2K sub-buckets
+    'L': ((13,), (678, 540, 7.5, 0)), # 2 ** 13 = 8K sub-buckets
+    'XL': ((16,), (678, 540, 50, 0)), # 2 ** 16 = 64K sub-buckets
+  }
+  hw_module = 'FineGrainedBucket'
+  generics = ('NUM_SUB_BUCKETS_BITS',)
+  # Sub-bucket addresses are 32-bit
+  generic_space = (range(1, 33),)
 
   latency = 4 # clock cycles
+  # Updates block the input while the BRAM read-modify-write completes (ST_READ, ST_READ_BRAM, ST_WRITE). The last
+  # forwarding_depth written sub-buckets are kept in ff_mem, an update that hits one of them skips ST_READ_BRAM.
+  initiation_interval = 4 # clock cycles between two accepted samples
+  forwarded_initiation_interval = 3 # clock cycles
+  forwarding_depth = 4 # ff_mem entries
 
   def __init__(self, num_sub_buckets_bits):
     super().__init__()
@@ -433,23 +819,17 @@ class FineGrainedBucket(Bucket):
     self.num_sub_buckets_bits = num_sub_buckets_bits
     self.num_sub_buckets = 2 ** num_sub_buckets_bits
     self.is_configured = False
-    self.histogram = [0] * self.num_sub_buckets
-
-    if num_sub_buckets_bits <= 7:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_S
-    elif num_sub_buckets_bits <= 11:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_M
-    elif num_sub_buckets_bits <= 13:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_L
-    else:
-      (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_XL
+    self.histogram = np.zeros(self.num_sub_buckets, dtype=np.uint32)
+    (self.LUT, self.FF, self.BRAM, self.DSP) = self.resources_of_arguments((num_sub_buckets_bits,))
 
   def config(self, low, high):
     if self.is_configured == False:
       self.low = low
       self.high = high
-      self.msb_pos = int(math.log2(next_power_of_2(high - low)))
+      # next_power_of_2 is 0 for a single value segment
+      self.msb_pos = int(math.log2(max(next_power_of_2(high - low), 1)))
       self.is_configured = True
+      Bucket.layout_version += 1
 
   def compute_address(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
@@ -467,34 +847,90 @@ class FineGrainedBucket(Bucket):
   def read(self, val):
     if self.is_configured == True and val >= self.low and val < self.high:
       addr = self.compute_address(val)
-      return self.histogram[addr]
+      return int(self.histogram[addr])
     else:
       return 0
 
+  def compute_addresses(self, values):
+    return np.minimum(self.num_sub_buckets - 1, (values - self.low) >> max(self.msb_pos - self.num_sub_buckets_bits, 0))
+
+  # The hardware neither range checks nor clamps the address of an update, ff_mem compares the full 32-bit addresses
+  # and starts out holding address 0
+  def stream_cycles(self, values):
+    values = np.asarray(values, dtype=np.int64)
+    addresses = ((values - self.low) & 0xFFFFFFFF) >> max(self.msb_pos - self.num_sub_buckets_bits, 0)
+    written = np.concatenate((np.zeros(self.forwarding_depth, dtype=np.int64), addresses))
+    forwarded = np.zeros(len(values), dtype=bool)
+    for depth in range(1, self.forwarding_depth + 1):
+      forwarded |= written[self.forwarding_depth - depth:len(written) - depth] == addresses
+    return np.where(forwarded, self.forwarded_initiation_interval, self.initiation_interval)
+
+  def add_to_histogram(self, sub_bucket_counts):
+    self.histogram += sub_bucket_counts.astype(np.uint32)
+    self.count += int(sub_bucket_counts.sum())
+
+  def update_many(self, values):
+    values = self.values_in_range(values)
+    self.add_to_histogram(np.bincount(self.compute_addresses(values), minlength=self.num_sub_buckets))
+
+  def load_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    sub_bucket_counts = np.zeros(self.num_sub_buckets, dtype=np.int64)
+    np.add.at(sub_bucket_counts, self.compute_addresses(values), counts)
+    self.add_to_histogram(sub_bucket_counts)
+
+  # Number of values of [low, high) that are mapped to each sub-bucket
+  def sub_bucket_widths(self):
+    shift = max(self.msb_pos - self.num_sub_buckets_bits, 0)
+    starts = np.arange(self.num_sub_buckets, dtype=np.int64) << shift
+    widths = np.clip(self.high - self.low - starts, 0, 1 << shift)
+    widths[-1] = max(0, self.high - self.low - int(starts[-1]))
+    return widths
+
+  def estimate_array(self):
+    if self.is_configured == False:
+      return np.zeros(0, dtype=np.int64)
+    histogram = self.histogram.astype(np.int64)
+    return histogram[self.compute_addresses(np.arange(self.low, self.high, dtype=np.int64))]
+
+  def squared_estimate_total(self):
+    if self.is_configured == False:
+      return 0
+    histogram = self.histogram.astype(np.int64)
+    return int(np.dot(self.sub_bucket_widths(), histogram * histogram))
+
+  def sse_of_counts(self, values, counts):
+    values, counts = self.counts_in_range(values, counts)
+    if self.is_configured == False:
+      return 0
+    estimates = self.histogram.astype(np.int64)[self.compute_addresses(values)]
+    return self.squared_estimate_total() + int(np.dot(counts, counts - 2 * estimates))
+
   def get_resource_consumption(self):
     return (self.LUT, self.FF, self.BRAM, self.DSP)
 
+  # BRAM words of the sub-bucket histogram
   @classmethod
-  def get_resources_of_bucket(cls, size):
-    if size == 'S':
-      return cls.resources_S
-    elif size == 'M':
-      return cls.resources_M
-    elif size == 'L':
-      return cls.resources_L
-    else:
-      return cls.resources_XL
+  def resource_features(cls, args):
+    num_sub_buckets_bits, = args
+    # 32-bit sub-bucket counters packed into 18 Kb block RAM halves
+    return [1.0, math.ceil(2 ** num_sub_buckets_bits * 32 / 18432) / 2]
 
+  # Every value reads the count of its whole sub-bucket, the error is the count of the other values aliased to it.
+  # The nonzero values are taken as spread at random over the segment.
   @classmethod
-  def create_default_bucket(cls, size):
-    if size == 'S':
-      return FineGrainedBucket(7)
-    elif size == 'M':
-      return FineGrainedBucket(11)
-    elif size == 'L':
-      return FineGrainedBucket(13)
-    else:
-      return FineGrainedBucket(16)
+  def predicted_rmse(cls, args, statistics):
+    num_sub_buckets_bits, = args
+    width, total, distinct, squares = statistics
+    if width <= 2 ** num_sub_buckets_bits or distinct == 0:
+      return 0.0
+    shift = max(int(math.log2(next_power_of_2(width))) - num_sub_buckets_bits, 0)
+    aliased = max(2 ** shift, width / 2 ** num_sub_buckets_bits) - 1
+    density = distinct / width
+    mean, second = total / distinct, squares / distinct
+    expected = aliased * density * mean
+    variance = aliased * density * (second - density * mean * mean)
+    return rmse_of_sse(width * (variance + expected * expected), width)
 
   def avg_resource_usage(self, available_budget=None):
     if available_budget == None:
@@ -519,33 +955,364 @@ class FineGrainedBucket(Bucket):
     for i in range(len(self.histogram)):
       print(f"count({i}) = {self.histogram[i]}")
 
+# Registry of the bucket types explored by the composer, every declared variant of every type is a candidate.
+# Candidate tables and the candidate cache refer to types and sizes by index, so both lists are only appended to.
+BUCKET_TYPES = [CoarseGrainedSimpleBucket, CoarseGrainedDistinctBucket, CoarseGrainedBloomBucket, CoarseGrainedCountingBloomBucket, FineGrainedBucket]
+BUCKET_SIZES = ['S', 'M', 'L', 'XL']
+# (bucket type, size) of the variants whose resources are predicted by the resource model instead of synthesized
+MODEL_VARIANTS = set()
+
+def register_bucket_type(bucket_type):
+  if bucket_type not in BUCKET_TYPES:
+    BUCKET_TYPES.append(bucket_type)
+  for size in bucket_type.variants:
+    if size not in BUCKET_SIZES:
+      BUCKET_SIZES.append(size)
+
+# Adds or replaces a synthesized variant of a bucket type, e.g. with the utilization of a new implementation run
+def register_bucket_variant(bucket_type, size, args, resources):
+  bucket_type.variants = {**bucket_type.variants, size: (tuple(args), tuple(resources))}
+  MODEL_VARIANTS.discard((bucket_type, size))
+  register_bucket_type(bucket_type)
+
+def bucket_type_by_name(name):
+  for bucket_type in BUCKET_TYPES:
+    if bucket_type.__name__ == name:
+      return bucket_type
+  raise ValueError(f"Unknown bucket type '{name}'")
+
+# Identifies the registered types and sizes by name and constructor arguments. Cached evaluations and checkpoints
+# refer to them by index, so they are only valid for the registry they were written with.
+def registry_hash():
+  registry = [[bucket_type.__name__, [[size, BUCKET_SIZES.index(size), list(args)] for size, (args, resources) in bucket_type.variants.items()]] for bucket_type in BUCKET_TYPES]
+  return hashlib.sha1(json.dumps(registry).encode()).hexdigest()
+
+# Run-time changes of the registry (registered types, calibrated resource models, model variants). Processes started
+# with spawn or forkserver import the default registry, the sweep pool hands them this state to re-apply.
+def registry_state():
+  tables = {bucket_type: (bucket_type.variants, bucket_type.resource_model, bucket_type.resource_model_null) for bucket_type in BUCKET_TYPES}
+  return list(BUCKET_TYPES), list(BUCKET_SIZES), tables, set(MODEL_VARIANTS)
+
+def apply_registry_state(state):
+  bucket_types, bucket_sizes, tables, model_variants = state
+  BUCKET_TYPES[:] = bucket_types
+  BUCKET_SIZES[:] = bucket_sizes
+  for bucket_type, (variants, resource_model, resource_model_null) in tables.items():
+    bucket_type.variants = variants
+    bucket_type.resource_model = resource_model
+    bucket_type.resource_model_null = resource_model_null
+  MODEL_VARIANTS.clear()
+  MODEL_VARIANTS.update(model_variants)
+
+# Vivado utilization reports. Flat reports only have the totals of the design, hierarchical ones
+# (report_utilization -hierarchical) have a row per instance whose Module column is the VHDL entity.
+
+# Rows of the flat report (7-series and UltraScale names) -> index in (LUTs, FFs, BRAM, DSPs)
+UTILIZATION_SITES = {'Slice LUTs': 0, 'CLB LUTs': 0, 'Slice Registers': 1, 'CLB Registers': 1, 'Block RAM Tile': 2, 'DSPs': 3}
+
+def utilization_cells(line):
+  return line.strip()[1:-1].split('|')
+
+def utilization_number(cell):
+  try:
+    return float(cell.strip().rstrip('*'))
+  except ValueError:
+    return None
+
+# Returns the totals of the design as (LUTs, FFs, BRAM tiles, DSPs) and, for hierarchical reports, a list of
+# (instance, module, depth, resources) rows in report order
+def parse_utilization_report(report_path):
+  with open(report_path, mode='r', encoding='utf-8', errors='replace') as file:
+    lines = file.read().splitlines()
+
+  total = [0, 0, 0, 0]
+  instances = []
+  header = None
+  for line in lines:
+    # Border lines belong to the current table, anything else ends it
+    if not line.startswith('|'):
+      if not line.startswith('+'):
+        header = None
+      continue
+    cells = utilization_cells(line)
+    names = [cell.strip() for cell in cells]
+
+    if 'Instance' in names and 'Module' in names:
+      header = names
+      dsp_column = next(name for name in header if name.startswith('DSP'))
+      top_indent = None
+      continue
+
+    if header is not None:
+      columns = dict(zip(header, cells))
+      instance = columns['Instance']
+      indent = len(instance) - len(instance.lstrip())
+      top_indent = indent if top_indent is None else top_indent
+      BRAM = (utilization_number(columns.get('RAMB36', '0')) or 0) + (utilization_number(columns.get('RAMB18', '0')) or 0) / 2
+      resources = (utilization_number(columns['Total LUTs']), utilization_number(columns['FFs']), BRAM, utilization_number(columns[dsp_column]))
+      instances.append((instance.strip(), columns['Module'].strip(), (indent - top_indent) // 2, resources))
+      if indent == top_indent:
+        total = list(resources)
+      continue
+
+    site = names[0].rstrip('*').strip()
+    if site in UTILIZATION_SITES and len(names) > 1 and utilization_number(names[1]) is not None:
+      total[UTILIZATION_SITES[site]] = utilization_number(names[1])
+
+  return tuple(total), instances
+
+# An observation is ((bucket type, constructor arguments, count), ...), resources): the resources of a design made of
+# the given buckets. Single bucket observations come from the variants and from hierarchical reports, the totals of a
+# flat report are one observation of the whole design.
+
+# One observation per bucket instance of a hierarchical report. The generics are not part of the report: arguments
+# maps the bucket types of the synthesized design to their constructor arguments (the order of their generics), types
+# without generics need no entry.
+def report_bucket_observations(instances, arguments):
+  modules = {bucket_type.hw_module: bucket_type for bucket_type in BUCKET_TYPES}
+  observations = []
+  for instance, module, depth, resources in instances:
+    bucket_type = modules.get(re.sub(r'__parameterized\d+$', '', module))
+    if bucket_type is None:
+      continue
+    args = arguments.get(bucket_type, () if not bucket_type.generics else None)
+    if args is not None:
+      observations.append((((bucket_type, tuple(args), 1),), resources))
+  return observations
+
+# The totals of a flat report, buckets lists the (bucket type, constructor arguments, count) of the synthesized design
+def report_total_observation(total, buckets):
+  return (tuple((bucket_type, tuple(args), count) for bucket_type, args, count in buckets), tuple(total))
+
+# The synthesized variants as observations
+def variant_observations():
+  return [(((bucket_type, args, 1),), resources) for bucket_type in BUCKET_TYPES for size, (args, resources) in bucket_type.variants.items()
+          if (bucket_type, size) not in MODEL_VARIANTS]
+
+# Least squares fit of the resources of every bucket type on its resource_features, returns bucket type ->
+# (coefficients (features x 4), (undetermined feature directions, feature scale)). The coefficients of all types are
+# fitted together: a row holds the summed features of the buckets of each type in the observed design. Types without
+# observations are left out.
+def fit_resource_model(observations):
+  # Columns of the features of each type
+  offsets = {}
+  num_features = 0
+  for buckets, resources in observations:
+    for bucket_type, args, count in buckets:
+      if bucket_type not in offsets:
+        width = len(bucket_type.resource_features(args))
+        offsets[bucket_type] = (num_features, num_features + width)
+        num_features += width
+
+  features = np.zeros((len(observations), num_features), dtype=np.float64)
+  for row, (buckets, resources) in enumerate(observations):
+    for bucket_type, args, count in buckets:
+      start, end = offsets[bucket_type]
+      features[row, start:end] += count * np.asarray(bucket_type.resource_features(args), dtype=np.float64)
+  targets = np.array([resources for buckets, resources in observations], dtype=np.float64)
+
+  # Columns scaled to a unit maximum, the rank does not depend on the units of the features
+  scale = np.abs(features).max(axis=0)
+  scale[scale == 0] = 1
+  coefficients = np.linalg.lstsq(features / scale, targets, rcond=None)[0] / scale[:, None]
+  # Null space of the design matrix: the coefficients along it are an arbitrary minimum-norm split, e.g. between the
+  # intercept and the hash count of the Bloom filters when all observations have 3 hashes
+  singular, vt = np.linalg.svd(features / scale)[1:]
+  rank = int(np.sum(singular > singular.max() * 1e-9)) if len(singular) else 0
+  null = vt[rank:].T
+  return {bucket_type: (coefficients[start:end], (null[start:end], scale[start:end])) for bucket_type, (start, end) in offsets.items()}
+
+def apply_resource_model(model):
+  for bucket_type, (coefficients, null) in model.items():
+    bucket_type.resource_model = coefficients
+    bucket_type.resource_model_null = null
+
+# Fits the resource model on the registered variants and on the given reports, each a (report path, bucket type ->
+# constructor arguments, buckets) tuple. Hierarchical reports contribute their bucket instances, flat reports their
+# totals for the design made of buckets, a list of (bucket type, constructor arguments, count).
+def calibrate_resource_model(reports=()):
+  observations = variant_observations()
+  for report_path, arguments, buckets in reports:
+    total, instances = parse_utilization_report(report_path)
+    bucket_observations = report_bucket_observations(instances, arguments)
+    if bucket_observations:
+      observations += bucket_observations
+    elif buckets:
+      observations.append(report_total_observation(total, buckets))
+    else:
+      raise ValueError(f"{report_path} has no bucket instances, the buckets of its design are needed to fit its totals")
+  model = fit_resource_model(observations)
+  apply_resource_model(model)
+  return model
+
+# Registers variants at arbitrary constructor arguments with the resources predicted by the model, named after
+# their arguments
+def register_model_variants(bucket_type, arguments):
+  for args in arguments:
+    args = tuple(args)
+    if any(variant_args == args for variant_args, resources in bucket_type.variants.values()):
+      continue
+    size = '-'.join(str(arg) for arg in args)
+    register_bucket_variant(bucket_type, size, args, bucket_type.estimate_resources(args))
+    MODEL_VARIANTS.add((bucket_type, size))
+
+# Registers the legal combinations of the generics of the given bucket types (all of them by default) that fit at
+# least one of the resource budgets as model variants, e.g. not the 2 ** 32 counter filters the VHDL generics allow.
+# evaluate_candidates only simulates the ones that promising_variants selects for a segment.
+def register_generic_space(resource_budgets, bucket_types=None):
+  budgets = np.array([tuple(budget) for budget in resource_budgets], dtype=np.float64)
+  for bucket_type in list(BUCKET_TYPES if bucket_types is None else bucket_types):
+    if not bucket_type.generic_space:
+      continue
+    if bucket_type.resource_model is None:
+      calibrate_resource_model()
+    # Only the generics the observations determine the resources of, e.g. other hash counts need observations of them
+    arguments = [args for args in itertools.product(*bucket_type.generic_space) if bucket_type.resource_model_covers(args)]
+    register_model_variants(bucket_type, [args for args in arguments if np.any(np.all(np.array(bucket_type.estimate_resources(args)) <= budgets, axis=1))])
+
+# One row per candidate bucket of a segment: the bucket itself is only built for the selected candidates
+CANDIDATE_DTYPE = np.dtype([
+  ('type', np.int8),   # index in BUCKET_TYPES
+  ('size', np.int16),  # index in BUCKET_SIZES
+  ('low', np.int64),
+  ('high', np.int64),
+  ('err', np.float64),
+  ('LUT', np.int64),
+  ('FF', np.int64),
+  ('BRAM', np.float64),
+  ('DSP', np.int64),
+])
+
+def candidate_resources(candidates):
+  return np.stack([candidates['LUT'], candidates['FF'], candidates['BRAM'], candidates['DSP']], axis=-1).astype(np.float64)
+
+def configured_candidate_bucket(candidate):
+  bucket = BUCKET_TYPES[candidate['type']].create_default_bucket(BUCKET_SIZES[candidate['size']])
+  bucket.config(int(candidate['low']), int(candidate['high']))
+  return bucket
+
+def build_candidate_bucket(candidate, ground_truth_histo, min_val):
+  bucket = configured_candidate_bucket(candidate)
+  bucket.load_counts(*segment_counts(ground_truth_histo, min_val, bucket.low, bucket.high))
+  return bucket
+
 class HybridHistogram:
   def __init__(self, min, max):
     self.buckets = []
     self.min = min
     self.max = max
+    self.bucket_lows = None
+    self.sorted_buckets = None
+    self.indexed_version = None
 
   def add_bucket(self, bucket):
     if isinstance(bucket, Bucket):
       self.buckets.append(bucket)
+      self.bucket_lows = None
     else:
       raise TypeError("Bucket must be an instance of Bucket class or its subclasses...")
 
   def remove_bucket(self, bucket):
     if isinstance(bucket, Bucket) and bucket in self.buckets:
       self.buckets.remove(bucket)
+      self.bucket_lows = None
     else:
       raise TypeError("Bucket must be an instance of Bucket class or its subclasses...")
 
+  # Rebuilds the bucket index when buckets were added, removed or configured since it was built
+  def refresh_bucket_index(self):
+    if self.bucket_lows is None or self.indexed_version != Bucket.layout_version:
+      self.build_bucket_index()
+      self.indexed_version = Bucket.layout_version
+
+  # Sorted lower bounds of the configured buckets.
+  # Overlapping buckets leave sorted_buckets as None and values are routed by scanning all buckets.
+  def build_bucket_index(self):
+    ordered = sorted((bucket for bucket in self.buckets if bucket.is_configured == True and bucket.low < bucket.high), key=lambda bucket: bucket.low)
+    self.bucket_lows = [bucket.low for bucket in ordered]
+    self.sorted_buckets = ordered
+    for previous, bucket in zip(ordered, ordered[1:]):
+      if bucket.low < previous.high:
+        self.sorted_buckets = None
+        break
+
+  # The only bucket covering val, or None
+  def find_bucket(self, val):
+    i = bisect.bisect_right(self.bucket_lows, val) - 1
+    if i >= 0 and val < self.sorted_buckets[i].high:
+      return self.sorted_buckets[i]
+    return None
+
   def update(self, val):
-    for bucket in self.buckets:
-      bucket.update(val)
+    self.refresh_bucket_index()
+
+    if self.sorted_buckets is None:
+      for bucket in self.buckets:
+        bucket.update(val)
+    else:
+      bucket = self.find_bucket(val)
+      if bucket is not None:
+        bucket.update(val)
+
+  # Same as calling update for each value in order. Values are grouped by the bucket that covers them,
+  # a stable sort keeps their order within a bucket, which the Bloom buckets depend on.
+  def update_batch(self, values):
+    self.refresh_bucket_index()
+
+    values = np.asarray(values, dtype=np.int64)
+    if self.sorted_buckets is None:
+      for bucket in self.buckets:
+        bucket.update_many(values)
+      return
+
+    indices = np.searchsorted(self.bucket_lows, values, side='right') - 1
+    order = np.argsort(indices, kind='stable')
+    bounds = np.searchsorted(indices[order], np.arange(len(self.sorted_buckets) + 1))
+    for i, bucket in enumerate(self.sorted_buckets):
+      if bounds[i + 1] > bounds[i]:
+        bucket.update_many(values[order[bounds[i]:bounds[i + 1]]])
+
+  # Same as update_batch
+  def update_many(self, values):
+    self.update_batch(values)
+
+  # Same as calling read for each value. Values are routed to the bucket covering them with the bucket index,
+  # overlapping layouts take the first non-zero estimate of the buckets in order like read.
+  def read_many(self, values):
+    self.refresh_bucket_index()
+
+    values = np.asarray(values, dtype=np.int64)
+    estimates = np.zeros(len(values), dtype=np.int64)
+    if self.sorted_buckets is None:
+      for bucket in self.buckets:
+        pending = np.flatnonzero(estimates == 0)
+        if len(pending) == 0:
+          break
+        estimates[pending] = bucket.read_many(values[pending])
+      return estimates
+
+    indices = np.searchsorted(self.bucket_lows, values, side='right') - 1
+    order = np.argsort(indices, kind='stable')
+    bounds = np.searchsorted(indices[order], np.arange(len(self.sorted_buckets) + 1))
+    for i, bucket in enumerate(self.sorted_buckets):
+      if bounds[i + 1] > bounds[i]:
+        positions = order[bounds[i]:bounds[i + 1]]
+        estimates[positions] = bucket.read_many(values[positions])
+    return estimates
 
   def read(self, val):
-    for bucket in self.buckets:
-      result = bucket.read(val)
-      if result > 0:
-        return result
+    self.refresh_bucket_index()
+
+    if self.sorted_buckets is None:
+      for bucket in self.buckets:
+        result = bucket.read(val)
+        if result > 0:
+          return result
+      return 0
+
+    bucket = self.find_bucket(val)
+    if bucket is not None:
+      return bucket.read(val)
     return 0
 
   def get_resource_consumption(self):
@@ -579,11 +1346,46 @@ class HybridHistogram:
       total_latency += bucket.latency
     return total_latency
 
+  # Clock cycles to ingest the stream. The buckets are chained with AXI4-Stream handshakes, a sample enters the chain
+  # once the slowest bucket is ready for it, and the last one leaves after the latency of the chain.
+  def stream_cycles(self, values):
+    cycles = np.ones(len(values), dtype=np.int64)
+    for bucket in self.buckets:
+      cycles = np.maximum(cycles, bucket.stream_cycles(values))
+    return int(cycles.sum()) + self.get_latency()
+
+  # Sustained samples per second at the given clock
+  def ingest_rate(self, values, clock_mhz):
+    if len(values) == 0:
+      return float('inf')
+    return len(values) * clock_mhz * 1e6 / self.stream_cycles(values)
+
+  # True if at most one bucket covers each value of [min, max), so read(x) is the read of the covering bucket
+  def has_disjoint_buckets(self):
+    ranges = sorted((bucket.low, bucket.high) for bucket in self.buckets if bucket.is_configured == True and bucket.low < bucket.high)
+    previous_high = self.min
+    for low, high in ranges:
+      if low < previous_high or high > self.max:
+        return False
+      previous_high = high
+    return True
+
+  # Same values as read(x) for every x in [min, max): the first bucket with a non-zero estimate wins
+  def as_array(self):
+    histo_array = np.zeros(self.max - self.min, dtype=np.int64)
+    for bucket in self.buckets:
+      low = max(bucket.low, self.min)
+      high = min(bucket.high, self.max)
+      if bucket.is_configured == False or low >= high:
+        continue
+      estimates = bucket.estimate_array()[low - bucket.low:high - bucket.low]
+      segment = histo_array[low - self.min:high - self.min]
+      unset = segment == 0
+      segment[unset] = estimates[unset]
+    return histo_array
+
   def as_list(self):
-    histo_list = []
-    for x in range(self.min, self.max):
-      histo_list.append(self.read(x))
-    return histo_list
+    return self.as_array().tolist()
 
   def print_all_frequencies(self):
     histo_list = self.as_list()
@@ -622,69 +1424,160 @@ def get_max_buckets_in_budget(res_budget, bucket_type, size):
   return int(min(max_buck_LUT, max_buck_FF, max_buck_BRAM, max_buck_DSP))
 
 def compute_per_value_histogram(data):
-  ground_truth = [0] * (max(data) + 1 - min(data))
-  for d in data:
-    ground_truth[d - min(data)] += 1
-
-  return ground_truth
+  data = np.asarray(data, dtype=np.int64)
+  return np.bincount(data - data.min()).tolist()
+
+# Ground truth stored as its sorted distinct values and their counts, independent of the value range
+class SparseHistogram:
+  def __init__(self, values, counts, cumulative_counts=None):
+    self.values = np.asarray(values, dtype=np.int64)
+    self.counts = np.asarray(counts, dtype=np.int64)
+    self.min = int(self.values[0])
+    self.max = int(self.values[-1])
+    # cumulative_counts[k] is the count of the k smallest distinct values, k itself is their cumulative distinct count
+    if cumulative_counts is None:
+      cumulative_counts = np.concatenate(([0], np.cumsum(self.counts)))
+    self.cumulative_counts = np.asarray(cumulative_counts, dtype=np.int64)
+
+  def total_count(self):
+    return int(self.cumulative_counts[-1])
+
+  def num_distinct(self):
+    return len(self.values)
+
+  # Non-zero (values, counts) of [low, high)
+  def segment(self, low, high):
+    start, end = np.searchsorted(self.values, (low, high))
+    return self.values[start:end], self.counts[start:end]
+
+  def count_in_range(self, low, high):
+    start, end = np.searchsorted(self.values, (low, high))
+    return int(self.cumulative_counts[end] - self.cumulative_counts[start])
+
+  # Counts of the ranges [lows[i], highs[i])
+  def counts_in_ranges(self, lows, highs):
+    starts = np.searchsorted(self.values, lows)
+    ends = np.searchsorted(self.values, highs)
+    return self.cumulative_counts[ends] - self.cumulative_counts[starts]
+
+  # Dense per value counts of [low, high)
+  def as_array(self, low, high):
+    values, counts = self.segment(low, high)
+    dense = np.zeros(high - low, dtype=np.int64)
+    dense[values - low] = counts
+    return dense
+
+def compute_sparse_histogram(data):
+  values, counts = np.unique(np.asarray(data, dtype=np.int64), return_counts=True)
+  return SparseHistogram(values, counts)
+
+def as_sparse_histogram(ground_truth_histo, min_val):
+  if isinstance(ground_truth_histo, SparseHistogram):
+    return ground_truth_histo
+  ground_truth = np.asarray(ground_truth_histo, dtype=np.int64)
+  nonzero = np.flatnonzero(ground_truth)
+  return SparseHistogram(nonzero + min_val, ground_truth[nonzero])
+
+# (min, max) of the data, taken from the ground truth when it is sparse so that data is not scanned
+def ground_truth_bounds(data, ground_truth_histo):
+  if isinstance(ground_truth_histo, SparseHistogram):
+    return ground_truth_histo.min, ground_truth_histo.max
+  return min(data), max(data)
+
+# Dense per value counts of [low, high) for both ground truth representations
+def ground_truth_array(ground_truth_histo, min_val, low, high):
+  if isinstance(ground_truth_histo, SparseHistogram):
+    return ground_truth_histo.as_array(low, high)
+  return np.asarray(ground_truth_histo[low - min_val:high - min_val], dtype=np.int64)
+
+# Non-zero (values, counts) of [low, high) for both ground truth representations
+def segment_counts(ground_truth_histo, min_val, low, high):
+  if isinstance(ground_truth_histo, SparseHistogram):
+    return ground_truth_histo.segment(low, high)
+  segment = np.asarray(ground_truth_histo[low - min_val:high - min_val], dtype=np.int64)
+  nonzero = np.flatnonzero(segment)
+  return nonzero + low, segment[nonzero]
+
+# (width, total count, distinct values, sum of squared counts) of [low, high), the inputs of the error models
+def segment_statistics(values, counts, low, high):
+  return (high - low, int(counts.sum()), len(values), int(np.dot(counts, counts)))
+
+# Estimate minus ground truth over [histo.min, histo.max)
+def histogram_errors(histo, ground_truth_histo):
+  return histo.as_array() - ground_truth_array(ground_truth_histo, histo.min, histo.min, histo.max)
+
+# Estimate minus ground truth over [bucket.low, bucket.high)
+def bucket_errors(bucket, ground_truth_histo, min_val):
+  return bucket.estimate_array() - ground_truth_array(ground_truth_histo, min_val, bucket.low, bucket.high)
+
+# Sum of squared errors over [histo.min, histo.max); with disjoint buckets it is computed bucket by bucket from the
+# non-zero ground truth only, values outside every bucket are read as 0
+def histogram_sse(histo, ground_truth_histo):
+  if histo.has_disjoint_buckets():
+    values, counts = segment_counts(ground_truth_histo, histo.min, histo.min, histo.max)
+    sse = int(np.dot(counts, counts))
+    for bucket in histo.buckets:
+      if bucket.is_configured == True and bucket.low < bucket.high:
+        values, counts = segment_counts(ground_truth_histo, histo.min, bucket.low, bucket.high)
+        sse += bucket.sse_of_counts(values, counts) - int(np.dot(counts, counts))
+    return sse
+
+  errors = histogram_errors(histo, ground_truth_histo)
+  return int(np.dot(errors, errors))
+
+def bucket_sse(bucket, ground_truth_histo, min_val):
+  return bucket.sse_of_counts(*segment_counts(ground_truth_histo, min_val, bucket.low, bucket.high))
 
 def mse(histo, ground_truth_histo):
-  mse = 0
-  for value in range(histo.min, histo.max):
-    mse += (histo.read(value) - ground_truth_histo[value - histo.min]) ** 2
-  return mse / (histo.max - histo.min)
+  return histogram_sse(histo, ground_truth_histo) / (histo.max - histo.min)
 
 def mae(histo, ground_truth_histo):
-  mae = 0
-  for value in range(histo.min, histo.max):
-    mae += abs(histo.read(value) - ground_truth_histo[value - histo.min])
-  return mae / (histo.max - histo.min)
+  errors = histogram_errors(histo, ground_truth_histo)
+  return int(np.abs(errors).sum()) / (histo.max - histo.min)
 
 def rmse(histo, ground_truth_histo):
-  rmse = 0
-  for value in range(histo.min, histo.max):
-    # if (histo.read(value) - ground_truth_histo[value - histo.min]) ** 2 != 0:
-    #   print(f"val = {value}: ground truth = {ground_truth_histo[value - histo.min]}, approx = {histo.read(value)}")
-    rmse += (histo.read(value) - ground_truth_histo[value - histo.min]) ** 2
-  return math.sqrt(rmse / (histo.max - histo.min))
+  return math.sqrt(histogram_sse(histo, ground_truth_histo) / (histo.max - histo.min))
 
 def mse_of_bucket(bucket, ground_truth_histo, min_val):
-  mse = 0
-  for value in range(bucket.low, bucket.high):
-    mse += (bucket.read(value) - ground_truth_histo[value - min_val]) ** 2
-  return mse / (bucket.high - bucket.low)
+  return bucket_sse(bucket, ground_truth_histo, min_val) / (bucket.high - bucket.low)
 
 def mae_of_bucket(bucket, ground_truth_histo, min_val):
-  mae = 0
-  for value in range(bucket.low, bucket.high):
-    mae += abs(bucket.read(value) - ground_truth_histo[value - min_val])
-  return mae / (bucket.high - bucket.low)
+  errors = bucket_errors(bucket, ground_truth_histo, min_val)
+  return int(np.abs(errors).sum()) / (bucket.high - bucket.low)
 
 def rmse_of_bucket(bucket, ground_truth_histo, min_val):
-  rmse = 0
-  for value in range(bucket.low, bucket.high):
-    rmse += (bucket.read(value) - ground_truth_histo[value - min_val]) ** 2
-  return math.sqrt(rmse / (bucket.high - bucket.low))
+  return math.sqrt(bucket_sse(bucket, ground_truth_histo, min_val) / (bucket.high - bucket.low))
+
+def rmse_of_bucket_counts(bucket, values, counts):
+  return math.sqrt(bucket.sse_of_counts(values, counts) / (bucket.high - bucket.low))
 
 def mse_per_bucket(histo, ground_truth_histo):
+  if not isinstance(ground_truth_histo, SparseHistogram):
+    ground_truth_histo = np.asarray(ground_truth_histo, dtype=np.int64)
   mse_list = []
   for bucket in histo.buckets:
     mse_list.append(mse_of_bucket(bucket, ground_truth_histo, histo.min))
   return mse_list
 
 def mae_per_bucket(histo, ground_truth_histo):
+  if not isinstance(ground_truth_histo, SparseHistogram):
+    ground_truth_histo = np.asarray(ground_truth_histo, dtype=np.int64)
   mae_list = []
   for bucket in histo.buckets:
     mae_list.append(mae_of_bucket(bucket, ground_truth_histo, histo.min))
   return mae_list
 
 def rmse_per_bucket(histo, ground_truth_histo):
+  if not isinstance(ground_truth_histo, SparseHistogram):
+    ground_truth_histo = np.asarray(ground_truth_histo, dtype=np.int64)
   rmse_list = []
   for bucket in histo.buckets:
     rmse_list.append(rmse_of_bucket(bucket, ground_truth_histo, histo.min))
   return rmse_list
 
 def plot_histogram(histo, ground_truth, min):
+  if isinstance(ground_truth, SparseHistogram):
+    ground_truth = ground_truth.as_array(ground_truth.min, ground_truth.max + 1)
   xs = [x for x in range(min, min + len(ground_truth))]
   plt.plot(xs, ground_truth, color="springgreen", label="Ground truth", alpha=0.5)
   plt.plot(xs, histo.as_list(), color="fuchsia", label="FPGA histo", alpha=0.5)
@@ -692,96 +1585,86 @@ def plot_histogram(histo, ground_truth, min):
   plt.show()
 
 def histogram_configuration(data, ground_truth_histo, num_buckets, strategy):
-  min_val = min(data)
-  max_val = max(data)
+  min_val, max_val = ground_truth_bounds(data, ground_truth_histo)
+  # Zero-count values never change a bucket's statistic, so the split works on the distinct values and their
+  # cumulative counts: bucket boundaries are found with a binary search instead of a value by value walk
+  ground_truth = as_sparse_histogram(ground_truth_histo, min_val)
+  values = ground_truth.values
+  cumulative_counts = ground_truth.cumulative_counts
+  num_distinct = len(values)
 
   if strategy == 'depth-count':
-    total_count = sum(ground_truth_histo)
+    total_count = int(cumulative_counts[-1])
     bucket_max_count = total_count // num_buckets
 
-    # print(f"total_count = {total_count}")
-    # print(f"num buckets = {num_buckets}")
-    # print(f"bucket_max_count = {bucket_max_count}")
-    # print(f"min = {min_val}")
-    # print(f"max = {max_val}")
-
-    current_count = 0
     low = min_val
-    high = low + 1
 
     buckets = []
     dif = 0
+    pos = 0
     for i in range(num_buckets):
-      index = low
-      first = True
-      while index < max_val + 1 and (current_count + dif < bucket_max_count or first == True):
-        current_count += ground_truth_histo[index - min_val]
-        index += 1
-        first = False
+      start = pos
+      # The first value of a bucket is always taken
+      if values[pos] == low:
+        pos += 1
+
+      # Values are taken while current_count + dif < bucket_max_count
+      end = int(np.searchsorted(cumulative_counts, cumulative_counts[start] + bucket_max_count - dif))
+      end = min(max(end, pos), num_distinct)
+
+      if end > pos:
+        high = int(values[end - 1]) + 1
+      else:
+        high = low + 1
+      pos = end
+      current_count = int(cumulative_counts[pos] - cumulative_counts[start])
 
       if current_count > bucket_max_count:
         dif += current_count - bucket_max_count
       else:
         dif = 0
 
-
-      high = index
-
-      if i == num_buckets - 1:
-        while (high < max_val + 1):
-          current_count += ground_truth_histo[high - min_val]
-          high += 1
+      if i == num_buckets - 1 and high < max_val + 1:
+        current_count += int(cumulative_counts[-1] - cumulative_counts[pos])
+        pos = num_distinct
+        high = max_val + 1
       buckets.append((low, high, current_count))
 
       if high == max_val + 1:
         break
 
       low = high
-      high += 1
-      current_count = 0
 
     return buckets
 
 
   elif strategy == 'depth-distinct':
-    total_distinct = 0
-
-    for h in ground_truth_histo:
-      if h > 0:
-        total_distinct += 1
+    bucket_max_distinct = num_distinct // num_buckets
 
-    bucket_max_distinct = total_distinct // num_buckets
-
-    # print(f"total_distinct = {total_distinct}")
-    # print(f"num buckets = {num_buckets}")
-    # print(f"bucket_max_dist = {bucket_max_distinct}")
-
-    current_distinct = 0
     low = min_val
-    high = low + 1
 
     buckets = []
     dif = 0
+    pos = 0
     for i in range(num_buckets):
-      index = low
-      while index < max_val + 1 and current_distinct + dif < bucket_max_distinct:
-        if ground_truth_histo[index - min_val]:
-            current_distinct += 1
-        index += 1
+      # The cumulative distinct count of the sparse ground truth is the position itself
+      current_distinct = min(max(bucket_max_distinct - dif, 0), num_distinct - pos)
+
+      if current_distinct > 0:
+        pos += current_distinct
+        high = int(values[pos - 1]) + 1
+      else:
+        high = low
 
       if current_distinct > bucket_max_distinct:
         dif += current_distinct - bucket_max_distinct
       else:
         dif = 0
 
-      high = index
-
-      if i == num_buckets - 1:
-        while (high < max_val + 1):
-          if ground_truth_histo[high - min_val]:
-            current_distinct += 1
-          high += 1
-
+      if i == num_buckets - 1 and high < max_val + 1:
+        current_distinct += num_distinct - pos
+        pos = num_distinct
+        high = max_val + 1
 
       buckets.append((low, high, current_distinct))
 
@@ -789,8 +1672,6 @@ def histogram_configuration(data, ground_truth_histo, num_buckets, strategy):
         break
 
       low = high
-      high += 1
-      current_distinct = 0
 
     return buckets
 
@@ -798,55 +1679,169 @@ def histogram_configuration(data, ground_truth_histo, num_buckets, strategy):
     range_size = (max_val - min_val) // num_buckets
     rem = (max_val - min_val) % num_buckets
 
-    # print(f"range size = {range_size}")
-    # print(f"rem = {rem}")
-
-    bucket_count = 0
-    current_count = 0
-    low = min_val
-
-    if rem > 0:
-      high = low + range_size + 1
-      rem -= 1
-    else:
-      high = low + range_size
-
-    buckets = []
+    # The first rem buckets are one value wider, the last one is extended up to max_val
+    widths = np.full(num_buckets, range_size, dtype=np.int64)
+    widths[:rem] += 1
+    highs = min_val + np.cumsum(widths)
+    lows = highs - widths
+    highs[-1] = max(highs[-1], max_val + 1)
 
-    for i in range(num_buckets):
-      for j in range(low, high):
-        current_count += ground_truth_histo[j - min_val]
+    counts = ground_truth.counts_in_ranges(lows, highs)
 
-      if i == num_buckets - 1:
-        while (high < max_val + 1):
-          current_count += ground_truth_histo[high - min_val]
-          high += 1
-        # print(f"low = {low}")
-        # print(f"high = {high}")
+    return [(int(low), int(high), int(count)) for low, high, count in zip(lows, highs, counts)]
 
+  else:
+    return []
 
-      buckets.append((low, high, current_count))
+# Identifies a ground truth so that cached candidate evaluations are only reused for the same dataset
+def dataset_hash(ground_truth_histo, min_val):
+  ground_truth = as_sparse_histogram(ground_truth_histo, min_val)
+  digest = hashlib.sha1()
+  digest.update(ground_truth.values.tobytes())
+  digest.update(ground_truth.counts.tobytes())
+  return digest.hexdigest()
+
+# Memoized (err, LUT, FF, BRAM, DSP) of the candidates, keyed on (low, high, bucket type, size).
+# Bounded LRU in memory, optionally backed by a SQLite file shared by all runs over the same dataset and bucket registry.
+class CandidateCache:
+  def __init__(self, ground_truth_histo, min_val, max_entries=100000, db_path=None):
+    self.dataset = dataset_hash(ground_truth_histo, min_val) + '-' + registry_hash()
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.db = None
+    if db_path is not None:
+      # Parallel sweeps share the file, writers wait for each other instead of failing
+      self.db = sqlite3.connect(db_path, timeout=60)
+      self.db.execute(
+        "CREATE TABLE IF NOT EXISTS candidates ("
+        "dataset TEXT, low INTEGER, high INTEGER, type INTEGER, size INTEGER, "
+        "err REAL, LUT INTEGER, FF INTEGER, BRAM REAL, DSP INTEGER, "
+        "PRIMARY KEY (dataset, low, high, type, size))"
+      )
+      self.db.commit()
+
+  def remember(self, key, value):
+    self.entries[key] = value
+    self.entries.move_to_end(key)
+    if len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+  def get(self, key):
+    value = self.entries.get(key)
+    if value is not None:
+      self.entries.move_to_end(key)
+    elif self.db is not None:
+      row = self.db.execute(
+        "SELECT err, LUT, FF, BRAM, DSP FROM candidates WHERE dataset = ? AND low = ? AND high = ? AND type = ? AND size = ?",
+        (self.dataset, *key)
+      ).fetchone()
+      if row is not None:
+        value = tuple(row)
+        self.remember(key, value)
+
+    if value is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return value
+
+  def put_many(self, items):
+    for key, value in items:
+      self.remember(key, value)
+    if self.db is not None and items:
+      self.db.executemany(
+        "INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(self.dataset, *key, *value) for key, value in items]
+      )
+      self.db.commit()
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+      self.db = None
+
+# Model variants a segment with the given statistics simulates: the ones within the resource budget that no cheaper
+# variant beats, i.e. predicts an RMSE at most PREDICTION_TOLERANCE higher (plus PREDICTION_FLOOR) with at most the
+# same resources. Synthesized variants are always simulated and take part as competitors.
+PREDICTION_TOLERANCE = 0.1
+PREDICTION_FLOOR = 0.01
+
+def promising_variants(statistics, resource_budget=None):
+  variants = [(bucket_type, size) for bucket_type in BUCKET_TYPES for size in bucket_type.variants]
+  resources = np.array([bucket_type.get_resources_of_bucket(size) for bucket_type, size in variants], dtype=np.float64)
+  predicted = np.array([bucket_type.predicted_rmse(bucket_type.variants[size][0], statistics) for bucket_type, size in variants], dtype=np.float64)
+  modeled = np.array([variant in MODEL_VARIANTS for variant in variants], dtype=bool)
+  # Types without an error model are always simulated but never beat anything
+  unknown = np.isnan(predicted)
+  predicted[unknown] = np.inf
+  within_budget = np.ones(len(variants), dtype=bool)
+  if resource_budget is not None:
+    within_budget = np.all(resources <= np.array(resource_budget, dtype=np.float64), axis=1)
+
+  keep = ~modeled
+  kept = list(np.flatnonzero(keep & ~unknown))
+  # A variant can only be beaten by the ones before it: cheapest first, most accurate first among equal resources
+  for i in np.lexsort((predicted, resources[:, 3], resources[:, 2], resources[:, 1], resources[:, 0])):
+    if keep[i] or not within_budget[i]:
+      continue
+    if unknown[i]:
+      keep[i] = True
+      continue
+    cheaper = np.all(resources[kept] <= resources[i], axis=1)
+    if not np.any(cheaper & (predicted[kept] <= predicted[i] * (1 + PREDICTION_TOLERANCE) + PREDICTION_FLOOR)):
+      keep[i] = True
+      kept.append(i)
+  return {variant for variant, promising in zip(variants, keep) if promising}
+
+# Candidate table of the segment [low, high), ordered by (err, LUT, FF, BRAM, DSP)
+# One candidate per registered (bucket type, size) variant, model variants only when promising_variants selects them.
+# Resources always come from the registry, so that re-synthesized variants take effect on cached evaluations.
+def evaluate_candidates(ground_truth_histo, min_val, low, high, cache=None, resource_budget=None):
+  values, counts = None, None
+  range_hashes = RangeHashes(low, high)
+
+  promising = None
+  if MODEL_VARIANTS:
+    values, counts = segment_counts(ground_truth_histo, min_val, low, high)
+    promising = promising_variants(segment_statistics(values, counts, low, high), resource_budget)
+
+  candidates = []
+  new_entries = []
+
+  for type_id, bucket_type in enumerate(BUCKET_TYPES):
+    for size in bucket_type.variants:
+      if promising is not None and (bucket_type, size) not in promising:
+        continue
+      key = (low, high, type_id, BUCKET_SIZES.index(size))
+      cached = cache.get(key) if cache is not None else None
+
+      if cached is None:
+        if values is None:
+          values, counts = segment_counts(ground_truth_histo, min_val, low, high)
 
-      low = high
+        bucket = bucket_type.create_default_bucket(size)
+        bucket.config(low, high)
+        bucket.use_hashes(range_hashes)
+        bucket.load_counts(values, counts)
 
-      if rem > 0:
-        rem -= 1
-        high += range_size + 1
-      else:
-        high += range_size
+        err = rmse_of_bucket_counts(bucket, values, counts)
+        LUT, FF, BRAM, DSP = bucket.get_resource_consumption()
+        cached = (err, LUT, FF, BRAM, DSP)
+        new_entries.append((key, cached))
 
-      current_count = 0
+      candidates.append((type_id, key[3], low, high, cached[0], *bucket_type.get_resources_of_bucket(size)))
 
-    return buckets
+  if cache is not None:
+    cache.put_many(new_entries)
 
-  else:
-    return []
+  candidates = np.array(candidates, dtype=CANDIDATE_DTYPE)
+  return candidates[np.lexsort((candidates['DSP'], candidates['BRAM'], candidates['FF'], candidates['LUT'], candidates['err']))]
 
-def construct_candidates(data, ground_truth_histo, resource_budget, num_buckets, split_strategy, bit):
+def construct_candidates(data, ground_truth_histo, resource_budget, num_buckets, split_strategy, bit, cache=None):
   avLUT, avFF, avBRAM, avDSP = resource_budget
 
-  bucket_types = [CoarseGrainedSimpleBucket, CoarseGrainedDistinctBucket, CoarseGrainedBloomBucket, CoarseGrainedCountingBloomBucket, FineGrainedBucket]
-  sizes = ['S', 'M', 'L']
   buckets_config = histogram_configuration(data, ground_truth_histo, num_buckets, split_strategy)
 
   if bit == True and len(buckets_config) < num_buckets:
@@ -854,63 +1849,48 @@ def construct_candidates(data, ground_truth_histo, resource_budget, num_buckets,
 
   ordered_candidate_buckets = []
 
-  min_data = min(data)
+  min_data, max_data = ground_truth_bounds(data, ground_truth_histo)
 
   for config in buckets_config:
     low, high, stat = config
 
-    candidate_buckets = []
-
-    for bucket_type in bucket_types:
-      # if high - low < 50 and bucket_type == FineGrainedBucket or high - low < 50 and bucket_type == CoarseGrainedCountingBloomBucket:
-      #   continue
+    candidates = evaluate_candidates(ground_truth_histo, min_data, low, high, cache, resource_budget)
+    in_budget = (candidates['LUT'] <= avLUT) & (candidates['FF'] <= avFF) & (candidates['BRAM'] <= avBRAM) & (candidates['DSP'] <= avDSP)
+    ordered_candidate_buckets.append(candidates[in_budget])
 
-      for size in sizes:
-        bucket = bucket_type.create_default_bucket(size)
-        bucket.config(low, high)
-
-        for sample in range(low, high):
-          ground_truth_count = ground_truth_histo[sample - min_data]
-
-          while ground_truth_count > 0:
-            bucket.update(sample)
-            ground_truth_count -= 1
-
-        err = rmse_of_bucket(bucket, ground_truth_histo, min_data)
-        LUT, FF, BRAM, DSP = bucket.get_resource_consumption()
-        if LUT > avLUT or FF > avFF or BRAM > avBRAM or DSP > avDSP:
-          continue
-
-        candidate_buckets.append((bucket, err, LUT, FF, BRAM, DSP))
+  return ordered_candidate_buckets
 
-    candidate_buckets.sort(key=lambda x: (x[1], x[2], x[3], x[4], x[5]))
-    ordered_candidate_buckets.append(candidate_buckets)
+# HybridHistogram made of the buckets of the selected candidates, built in increasing order of their lower bound
+def build_histogram(selected_buckets, ground_truth_histo, min_val, max_val):
+  selected_buckets.sort(key=lambda selected: selected['low'])
+  histo = HybridHistogram(min_val, max_val + 1)
+  for candidate in selected_buckets:
+    histo.add_bucket(build_candidate_bucket(candidate, ground_truth_histo, min_val))
+  return histo
 
-
-  return ordered_candidate_buckets
+def selected_buckets_info(histo, selected_buckets):
+  buckets_str = ''
+  for bucket, candidate in zip(histo.buckets, selected_buckets):
+    buckets_str += '(' + str(type(bucket)) + ' : ' + str(float(candidate['err'])) + ') '
+  return buckets_str
 
 def greedy_min_error_histogram(candidate_buckets, resource_budget, eps=10, opt_resources=False):
-  available_resources = resource_budget
+  available_resources = np.array(resource_budget, dtype=np.float64)
 
   # print(candidate_buckets)
   selected_buckets = []
 
   for candidate_list in candidate_buckets:
-    chosen_bucket = None
-    for candidate in candidate_list:
-      candidate_bucket, candidate_err, candidate_LUT, candidate_FF, candidate_BRAM, candidate_DSP = candidate
-      updated_available_resources = tuple(a - b for a, b in zip(available_resources, candidate_bucket.get_resource_consumption()))
-      if all(r >= 0 for r in updated_available_resources): # and candidate_err < eps:
-        available_resources = updated_available_resources
-        chosen_bucket = candidate
-        selected_buckets.append(candidate)
-        break
-
-    if chosen_bucket is None:
+    fits = np.all(candidate_resources(candidate_list) <= available_resources, axis=1)
+    if not fits.any():
       print("Out of resources...")
       selected_buckets = None
       break
 
+    chosen = int(np.argmax(fits))
+    available_resources = available_resources - candidate_resources(candidate_list[chosen])
+    selected_buckets.append(candidate_list[chosen])
+
   return selected_buckets
 
 def greedy_avg_res_histogram(candidate_buckets, resource_budget, eps=10000, opt_resources=False):
@@ -922,40 +1902,29 @@ def greedy_avg_res_histogram(candidate_buckets, resource_budget, eps=10000, opt_
   avgBRAM //= N
   avgDSP //= N
 
-  available_resources = (avgLUT, avgFF, avgBRAM, avgDSP)
-  avr = (avgLUT, avgFF, avgBRAM, avgDSP)
-  # print(available_resources)
-  # print(resource_budget)
+  avr = np.array((avgLUT, avgFF, avgBRAM, avgDSP), dtype=np.float64)
 
   # print(candidate_buckets)
   selected_buckets = []
 
-  count = 0
-
-  unused_res = (0, 0, 0, 0)
+  unused_res = np.zeros(4)
 
   for candidate_list in candidate_buckets:
-    chosen_bucket = None
-    # print(candidate_list[0][0].low, candidate_list[0][0].high)
-    available_resources = tuple(a + b  for a, b in zip(avr, unused_res))
-    for candidate in candidate_list:
-      # print(candidate)
-      candidate_bucket, candidate_err, candidate_LUT, candidate_FF, candidate_BRAM, candidate_DSP = candidate
-      unused_res = tuple(a - b for a, b in zip(available_resources, candidate_bucket.get_resource_consumption()))
-      if all(r >= 0 for r in unused_res) : #and candidate_err < eps
-        chosen_bucket = candidate
-        selected_buckets.append(candidate)
-        count += 1
-        break
-
-    if chosen_bucket is None:
+    available_resources = avr + unused_res
+    fits = np.all(candidate_resources(candidate_list) <= available_resources, axis=1)
+    if not fits.any():
       print("Out of resources...")
       selected_buckets = None
       break
 
+    chosen = int(np.argmax(fits))
+    unused_res = available_resources - candidate_resources(candidate_list[chosen])
+    selected_buckets.append(candidate_list[chosen])
+
   return selected_buckets
 
-def simulated_annealing_histogram(candidate_buckets, resource_budget, first_sol='first', alpha=0.5, initial_temp=1000, cooling_rate=0.995, max_iterations=100000):
+# Reference implementation, recomputes the cost of the whole solution at every iteration
+def simulated_annealing_histogram_reference(candidate_buckets, resource_budget, first_sol='first', alpha=0.5, initial_temp=1000, cooling_rate=0.995, max_iterations=100000):
     max_LUT, max_FF, max_BRAM, max_DSP = resource_budget
 
     def calculate_cost(error, LUTs, FFs, BRAMs, DSPs, LUT_weight, FF_weight, BRAM_weight, DSP_weight):
@@ -984,7 +1953,7 @@ def simulated_annealing_histogram(candidate_buckets, resource_budget, first_sol=
       error = 0
       total_LUTs = total_FFs = total_BRAMs = total_DSPs = 0
       for i in range(n):
-          _, e, LUTs, FFs, BRAMs, DSPs = solution[i]
+          e, LUTs, FFs, BRAMs, DSPs = (solution[i][field].item() for field in ('err', 'LUT', 'FF', 'BRAM', 'DSP'))
           error += e
           total_LUTs += LUTs
           total_FFs += FFs
@@ -1029,44 +1998,608 @@ def simulated_annealing_histogram(candidate_buckets, resource_budget, first_sol=
         return None
     return best_solution
 
-def read_csv_file(file_path):
-  with open(file_path, mode='r') as file:
-    csv_reader = csv.reader(file)
-    data_list = []
-    for row in csv_reader:
-        data_list.append(int(row[1]))
-    return data_list
+# Same search as simulated_annealing_histogram_reference (and the same random number sequence), but the solution is
+# kept as one candidate index per segment together with running error and resource totals, so a move is evaluated
+# in O(1). Results can only differ through the rounding of the running error total.
+def simulated_annealing_histogram(candidate_buckets, resource_budget, first_sol='first', alpha=0.5, initial_temp=1000, cooling_rate=0.995, max_iterations=100000):
+    max_LUT, max_FF, max_BRAM, max_DSP = resource_budget
+
+    total_resources = max_LUT + max_FF + max_BRAM + max_DSP
+    LUT_weight = max_LUT / total_resources
+    FF_weight = max_FF / total_resources
+    BRAM_weight = max_BRAM / total_resources
+    DSP_weight = max_DSP / total_resources
+
+    def calculate_cost(error, LUTs, FFs, BRAMs, DSPs):
+      if LUTs > max_LUT or FFs > max_FF or BRAMs > max_BRAM or DSPs > max_DSP:
+        return float('inf')
+      resource_cost = (LUT_weight * LUTs + FF_weight * FFs + BRAM_weight * BRAMs + DSP_weight * DSPs) / (LUTs + FFs + BRAMs + DSPs)
+      return alpha * error + (1 - alpha) * resource_cost
+
+    n = len(candidate_buckets)
+    errs = [candidates['err'].tolist() for candidates in candidate_buckets]
+    resources = [candidate_resources(candidates).tolist() for candidates in candidate_buckets]
+
+    if first_sol == 'first':
+      current_solution = [0] * n
+    elif first_sol == 'last':
+      current_solution = [len(candidates) - 1 for candidates in candidate_buckets]
+    elif first_sol == 'middle':
+      current_solution = [len(candidates) // 2 for candidates in candidate_buckets]
+    else:
+      current_solution = [random.randrange(len(candidates)) for candidates in candidate_buckets]
+
+    error = 0
+    total_LUTs = total_FFs = total_BRAMs = total_DSPs = 0
+    for i in range(n):
+      e = errs[i][current_solution[i]]
+      LUTs, FFs, BRAMs, DSPs = resources[i][current_solution[i]]
+      error += e
+      total_LUTs += LUTs
+      total_FFs += FFs
+      total_BRAMs += BRAMs
+      total_DSPs += DSPs
+
+    current_cost = calculate_cost(error, total_LUTs, total_FFs, total_BRAMs, total_DSPs)
+
+    best_solution = current_solution[:]
+    best_cost = current_cost
+
+    temperature = initial_temp
+    iteration = 0
+
+    while temperature > 1e-3 and iteration < max_iterations:
+      iteration += 1
+
+      range_idx = random.randint(0, n - 1)
+      candidate_idx = random.randint(0, len(candidate_buckets[range_idx]) - 1)
+
+      if candidate_idx == current_solution[range_idx]:
+        new_cost = current_cost
+      else:
+        old_e = errs[range_idx][current_solution[range_idx]]
+        old_LUTs, old_FFs, old_BRAMs, old_DSPs = resources[range_idx][current_solution[range_idx]]
+        new_e = errs[range_idx][candidate_idx]
+        new_LUTs, new_FFs, new_BRAMs, new_DSPs = resources[range_idx][candidate_idx]
+        new_error = error + (new_e - old_e)
+        new_total_LUTs = total_LUTs + (new_LUTs - old_LUTs)
+        new_total_FFs = total_FFs + (new_FFs - old_FFs)
+        new_total_BRAMs = total_BRAMs + (new_BRAMs - old_BRAMs)
+        new_total_DSPs = total_DSPs + (new_DSPs - old_DSPs)
+        new_cost = calculate_cost(new_error, new_total_LUTs, new_total_FFs, new_total_BRAMs, new_total_DSPs)
+
+      if new_cost < current_cost or random.random() < math.exp((current_cost - new_cost) / temperature):
+          if candidate_idx != current_solution[range_idx]:
+            current_solution[range_idx] = candidate_idx
+            error = new_error
+            total_LUTs = new_total_LUTs
+            total_FFs = new_total_FFs
+            total_BRAMs = new_total_BRAMs
+            total_DSPs = new_total_DSPs
+          current_cost = new_cost
+
+          if new_cost < best_cost:
+              best_solution = current_solution[:]
+              best_cost = new_cost
+
+      temperature *= cooling_rate
+
+    if best_cost == float('inf'):
+        return None
+    return [candidate_buckets[i][best_solution[i]] for i in range(n)]
+
+# Removes the candidates for which another candidate has a lower or equal error and lower or equal resources
+# (of identical candidates only the first one is kept). The result is ordered by (err, LUT, FF, BRAM, DSP).
+def pareto_prune(candidates):
+  candidates = candidates[np.lexsort((candidates['DSP'], candidates['BRAM'], candidates['FF'], candidates['LUT'], candidates['err']))]
+  resources = candidate_resources(candidates)
+
+  # Sorted by error, so a candidate can only be dominated by one that comes before it
+  kept = []
+  for i in range(len(candidates)):
+    if kept and np.any(np.all(resources[kept] <= resources[i], axis=1)):
+      continue
+    kept.append(i)
+
+  return candidates[kept]
+
+# Pareto filter applied between candidate construction and the selectors, returns the filtered candidate lists
+# and the number of removed candidates. Dominated candidates can never be part of a better solution.
+def pareto_filter_candidates(candidate_buckets):
+  filtered_candidates = [pareto_prune(candidates) for candidates in candidate_buckets]
+  removed = sum(len(candidates) for candidates in candidate_buckets) - sum(len(candidates) for candidates in filtered_candidates)
+  return filtered_candidates, removed
+
+# Samples per second a chain of the (not loaded) buckets of the selected candidates sustains on the sample stream
+def selection_ingest_rate(selected_buckets, samples, clock_mhz):
+  histo = HybridHistogram(0, 0)
+  for candidate in selected_buckets:
+    histo.add_bucket(configured_candidate_bucket(candidate))
+  return histo.ingest_rate(samples, clock_mhz)
+
+# Removes the candidates whose bucket alone cannot ingest the samples at target_rate (samples per second). A chain is
+# never faster than its slowest bucket, so no histogram made with them would meet the target. rates caches the rate of
+# every (type, size, low, high) across calls. Returns the filtered candidate lists and the number of removed candidates.
+def ingest_rate_filter_candidates(candidate_buckets, samples, clock_mhz, target_rate, rates=None):
+  if rates is None:
+    rates = {}
+
+  filtered_candidates = []
+  for candidates in candidate_buckets:
+    keep = np.zeros(len(candidates), dtype=bool)
+    for i, candidate in enumerate(candidates):
+      key = (int(candidate['type']), int(candidate['size']), int(candidate['low']), int(candidate['high']))
+      if key not in rates:
+        rates[key] = selection_ingest_rate([candidate], samples, clock_mhz)
+      keep[i] = rates[key] >= target_rate
+    filtered_candidates.append(candidates[keep])
+
+  removed = sum(len(candidates) for candidates in candidate_buckets) - sum(len(candidates) for candidates in filtered_candidates)
+  return filtered_candidates, removed
+
+# Picking one candidate per segment so that the total error is minimal under the resource budget is a multiple-choice
+# knapsack problem. It is solved exactly by depth-first branch and bound over the Pareto-optimal candidates, bounding
+# every node with the best of the remaining minimal errors and a Lagrangian relaxation of the four budget constraints.
+# When max_nodes or time_limit is reached the best solution found so far is returned together with its optimality gap.
+def knapsack_histogram(candidate_buckets, resource_budget, max_nodes=200000, time_limit=10.0, stats=None):
+  start_time = time.perf_counter()
+
+  candidate_tables = [pareto_prune(candidates) for candidates in candidate_buckets]
+  n = len(candidate_tables)
+  if n == 0 or any(len(candidates) == 0 for candidates in candidate_tables):
+    print("Out of resources...")
+    return None
+
+  budget = tuple(float(b) for b in resource_budget)
+  scale = tuple(b if b > 0 else 1.0 for b in budget)
+  errs = [candidates['err'].tolist() for candidates in candidate_tables]
+  resources = [[tuple(r) for r in candidate_resources(candidates).tolist()] for candidates in candidate_tables]
+
+  # Segments whose candidates differ the most in error are branched on first
+  order = sorted(range(n), key=lambda i: errs[i][0] - errs[i][-1])
+
+  best = {'err': float('inf'), 'choice': None}
+
+  def try_solution(solution):
+    used = [sum(resources[i][j][k] for i, j in enumerate(solution)) for k in range(4)]
+    if all(used[k] <= budget[k] for k in range(4)):
+      err = sum(errs[i][j] for i, j in enumerate(solution))
+      if err < best['err']:
+        best['err'] = err
+        best['choice'] = list(solution)
+
+  # Subgradient ascent on the Lagrangian dual with normalized budgets, its feasible iterates seed the incumbent
+  normalized = [candidate_resources(candidates) / np.array(scale) for candidates in candidate_tables]
+  err_arrays = [candidates['err'] for candidates in candidate_tables]
+  step = sum(e[-1] - e[0] for e in errs) / n + 1e-9
+  lam = np.zeros(4)
+  best_lam = lam
+  root_bound = -float('inf')
+  for iteration in range(200):
+    picks = [int(np.argmin(e + r @ lam)) for e, r in zip(err_arrays, normalized)]
+    try_solution(picks)
+    bound = sum(float(e[j] + r[j] @ lam) for e, r, j in zip(err_arrays, normalized, picks)) - float(lam.sum())
+    if bound > root_bound:
+      root_bound = bound
+      best_lam = lam.copy()
+    subgradient = sum(r[j] for r, j in zip(normalized, picks)) - 1
+    if np.all(subgradient <= 0) and float(lam @ subgradient) == 0:
+      break
+    lam = np.maximum(0, lam + step / (iteration + 1) * subgradient)
+
+  # Greedy incumbent: start from the smallest candidates and keep applying the swap that removes the most error per
+  # normalized resource added while the budget holds
+  solution = [int(np.argmin(r.sum(axis=1))) for r in normalized]
+  used = [sum(resources[i][j][k] for i, j in enumerate(solution)) for k in range(4)]
+  if all(used[k] <= budget[k] for k in range(4)):
+    while True:
+      best_swap = None
+      best_ratio = 0
+      for i in range(n):
+        current = resources[i][solution[i]]
+        for j in range(len(errs[i])):
+          gain = errs[i][solution[i]] - errs[i][j]
+          if gain <= 0:
+            continue
+          if any(used[k] - current[k] + resources[i][j][k] > budget[k] for k in range(4)):
+            continue
+          added = sum(max(resources[i][j][k] - current[k], 0) / scale[k] for k in range(4))
+          ratio = gain / (added + 1e-12)
+          if ratio > best_ratio:
+            best_ratio = ratio
+            best_swap = (i, j)
+      if best_swap is None:
+        break
+      i, j = best_swap
+      used = [used[k] - resources[i][solution[i]][k] + resources[i][j][k] for k in range(4)]
+      solution[i] = j
+    try_solution(solution)
+
+  lam = best_lam.tolist()
+  lagrangian_min = [float(np.min(e + r @ best_lam)) for e, r in zip(err_arrays, normalized)]
+
+  # Suffix sums over the branching order of the per segment minimal error, Lagrangian term and resources
+  err_suffix = [0.0] * (n + 1)
+  lagrangian_suffix = [0.0] * (n + 1)
+  resource_suffix = [(0.0, 0.0, 0.0, 0.0)] * (n + 1)
+  for d in range(n - 1, -1, -1):
+    i = order[d]
+    err_suffix[d] = err_suffix[d + 1] + errs[i][0]
+    lagrangian_suffix[d] = lagrangian_suffix[d + 1] + lagrangian_min[i]
+    resource_suffix[d] = tuple(a + min(r[k] for r in resources[i]) for k, a in enumerate(resource_suffix[d + 1]))
+
+  lower_bound = max(err_suffix[0], root_bound)
+
+  choice = [0] * n
+  nodes = 0
+  truncated = False
+
+  def search(d, err, used):
+    nonlocal nodes, truncated
+    nodes += 1
+    if nodes > max_nodes or (nodes % 1000 == 0 and time.perf_counter() - start_time > time_limit):
+      truncated = True
+      return
+
+    if d == n:
+      if err < best['err']:
+        best['err'] = err
+        best['choice'] = choice[:]
+      return
+
+    i = order[d]
+    rest = resource_suffix[d + 1]
+    for j, e in enumerate(errs[i]):
+      new_err = err + e
+      # Candidates are sorted by error, so no later candidate of this segment can do better
+      if new_err + err_suffix[d + 1] >= best['err']:
+        break
+
+      r = resources[i][j]
+      new_used = (used[0] + r[0], used[1] + r[1], used[2] + r[2], used[3] + r[3])
+      if any(new_used[k] + rest[k] > budget[k] for k in range(4)):
+        continue
+
+      slack = sum(lam[k] * (1 - new_used[k] / scale[k]) for k in range(4))
+      if new_err + lagrangian_suffix[d + 1] - slack >= best['err']:
+        continue
+
+      choice[i] = j
+      search(d + 1, new_err, new_used)
+      if truncated:
+        return
+
+  search(0, 0.0, (0.0, 0.0, 0.0, 0.0))
+
+  runtime = time.perf_counter() - start_time
+  if best['choice'] is None:
+    gap = 0.0 if not truncated else float('inf')
+  elif not truncated or best['err'] <= lower_bound:
+    gap = 0.0
+  else:
+    gap = (best['err'] - lower_bound) / best['err']
+
+  print(f"knapsack: {nodes} nodes, runtime = {runtime:.3f} s, optimality gap = {gap:.2%}")
+  if stats is not None:
+    stats.update({'runtime': runtime, 'gap': gap, 'nodes': nodes, 'lower_bound': lower_bound,
+                  'pruned_candidates': sum(len(c) for c in candidate_buckets) - sum(len(c) for c in candidate_tables)})
+
+  if best['choice'] is None:
+    print("Out of resources...")
+    return None
+  return [candidate_tables[i][best['choice'][i]] for i in range(n)]
+
+# Candidate boundaries of the split point optimizer, ascending from min to max + 1: equi-depth and equi-width
+# boundaries, both ends of the widest gaps between distinct values and both sides of the highest spikes, so that a
+# narrow bucket can isolate them
+def split_points(ground_truth, max_breakpoints=64):
+  values = ground_truth.values
+  counts = ground_truth.counts
+  cumulative_counts = ground_truth.cumulative_counts
+  quota = max(max_breakpoints // 4, 1)
+
+  positions = np.searchsorted(cumulative_counts, np.linspace(0, cumulative_counts[-1], quota + 1)[1:-1])
+  points = [values[np.clip(positions, 0, len(values) - 1)]]
+  points.append(np.linspace(ground_truth.min, ground_truth.max + 1, quota + 1)[1:-1].astype(np.int64))
+
+  gaps = np.argsort(values[:-1] - values[1:], kind='stable')[:quota // 2]
+  gaps = gaps[values[gaps + 1] - values[gaps] > 1]
+  points += [values[gaps] + 1, values[gaps + 1]]
+
+  spikes = np.argsort(-counts, kind='stable')[:quota // 2]
+  points += [values[spikes], values[spikes] + 1]
+
+  points = np.unique(np.concatenate(points + [[ground_truth.min, ground_truth.max + 1]]))
+  return points[(points >= ground_truth.min) & (points <= ground_truth.max + 1)]
+
+# Predicted SSE of every variant within the budget on every segment [points[i], points[j]) of the split points. The
+# statistics of a segment come from prefix sums of the counts, squared counts and distinct values, so each one is
+# scored in O(1) by the error models of the bucket types.
+# Every bucket of the chain sees every sample, so with a max_interval (clock cycles per sample of the target ingest
+# rate) the types that cannot accept samples that often are left out.
+class SplitPointCosts:
+  def __init__(self, ground_truth_histo, min_val, resource_budget, max_breakpoints=64, max_interval=None):
+    ground_truth = as_sparse_histogram(ground_truth_histo, min_val)
+    self.points = split_points(ground_truth, max_breakpoints)
+
+    self.variants = []
+    for type_id, bucket_type in enumerate(BUCKET_TYPES):
+      fastest_interval = min(bucket_type.initiation_interval, getattr(bucket_type, 'forwarded_initiation_interval', bucket_type.initiation_interval))
+      if max_interval is not None and fastest_interval > max_interval:
+        continue
+      for size, (args, resources) in bucket_type.variants.items():
+        if all(r <= b for r, b in zip(resources, resource_budget)):
+          self.variants.append((type_id, BUCKET_SIZES.index(size), args, resources))
+    self.resources = np.array([resources for type_id, size, args, resources in self.variants], dtype=np.float64).reshape(-1, 4)
+
+    positions = np.searchsorted(ground_truth.values, self.points)
+    cumulative_squares = np.concatenate(([0], np.cumsum(ground_truth.counts * ground_truth.counts)))
+    self.starts, self.ends = np.triu_indices(len(self.points), 1)
+    self.sse = np.full((len(self.starts), len(self.variants)), np.inf)
+    for pair, (i, j) in enumerate(zip(self.starts.tolist(), self.ends.tolist())):
+      width = int(self.points[j] - self.points[i])
+      statistics = (width, int(ground_truth.cumulative_counts[positions[j]] - ground_truth.cumulative_counts[positions[i]]),
+                    int(positions[j] - positions[i]), int(cumulative_squares[positions[j]] - cumulative_squares[positions[i]]))
+      for v, (type_id, size, args, resources) in enumerate(self.variants):
+        predicted = BUCKET_TYPES[type_id].predicted_rmse(args, statistics)
+        if predicted is not None:
+          self.sse[pair, v] = predicted * predicted * width
+
+# Boundaries and variants of k = 1..num_buckets segments minimizing the predicted SSE plus the Lagrangian price lam
+# of their normalized resources. Returns the (SSE, resources, [(start point, end point, variant)]) solution of every
+# k, None when no k segments cover the split points.
+def split_point_dp(costs, scale, lam, num_buckets):
+  priced = costs.sse + costs.resources / scale @ lam
+  best_variant = np.argmin(priced, axis=1)
+  num_points = len(costs.points)
+  segment_cost = np.full((num_points, num_points), np.inf)
+  segment_cost[costs.starts, costs.ends] = priced[np.arange(len(priced)), best_variant]
+  variant = np.zeros((num_points, num_points), dtype=np.int64)
+  variant[costs.starts, costs.ends] = best_variant
+
+  # best[k][j]: cheapest cover of [points[0], points[j]) with k segments
+  best = np.full((num_buckets + 1, num_points), np.inf)
+  best[0, 0] = 0
+  previous = np.zeros((num_buckets + 1, num_points), dtype=np.int64)
+  for k in range(1, num_buckets + 1):
+    totals = best[k - 1][:, None] + segment_cost
+    previous[k] = np.argmin(totals, axis=0)
+    best[k] = totals[previous[k], np.arange(num_points)]
+
+  solutions = []
+  for num_segments in range(1, num_buckets + 1):
+    if not np.isfinite(best[num_segments, -1]):
+      solutions.append(None)
+      continue
+    segments = []
+    j = num_points - 1
+    for k in range(num_segments, 0, -1):
+      i = int(previous[k, j])
+      segments.append((i, j, int(variant[i, j])))
+      j = i
+    segments.reverse()
+    solutions.append(split_point_solution(costs, segments))
+  return solutions
+
+def split_point_solution(costs, segments):
+  sse = sum(float(costs.sse[pair_index(i, j, len(costs.points)), v]) for i, j, v in segments)
+  used = costs.resources[[v for i, j, v in segments]].sum(axis=0)
+  return sse, used, segments
+
+# Keeps applying the variant swap that removes the most predicted SSE per normalized resource added while the
+# budget holds
+def upgrade_segments(costs, segments, budget, scale):
+  segments = list(segments)
+  num_points = len(costs.points)
+  used = costs.resources[[v for i, j, v in segments]].sum(axis=0)
+  while True:
+    best_swap = None
+    best_ratio = 0
+    for position, (i, j, v) in enumerate(segments):
+      sse = costs.sse[pair_index(i, j, num_points)]
+      fitting = np.all(used - costs.resources[v] + costs.resources <= budget, axis=1)
+      added = np.maximum(costs.resources - costs.resources[v], 0) / scale
+      gain = sse[v] - sse
+      ratio = np.where(fitting & (gain > 0), gain / (added.sum(axis=1) + 1e-12), 0)
+      w = int(np.argmax(ratio))
+      if ratio[w] > best_ratio:
+        best_ratio = ratio[w]
+        best_swap = (position, w)
+    if best_swap is None:
+      return segments
+    position, w = best_swap
+    i, j, v = segments[position]
+    used = used - costs.resources[v] + costs.resources[w]
+    segments[position] = (i, j, w)
+
+# Position of the segment (i, j) in the np.triu_indices(num_points, 1) order
+def pair_index(i, j, num_points):
+  return i * num_points - i * (i + 1) // 2 + j - i - 1
+
+# V-optimal style split point optimizer: chooses the boundaries among the split points and the variant of every
+# bucket together, minimizing the total predicted SSE of at most num_buckets buckets under the resource budget. The
+# budget is relaxed with Lagrange multipliers (prices of the normalized resources): the prices of the exceeded
+# resources are doubled until the relaxed optimum fits, then bisected between the last prices that did not fit and
+# the ones that did. The leftover budget of the best fitting histograms met on the way is spent by greedily upgrading
+# variants. The selected candidates carry their exact RMSE.
+def dp_histogram(costs, ground_truth_histo, min_val, resource_budget, num_buckets, iterations=40, upgrades=8):
+  start_time = time.perf_counter()
+  budget = np.array(resource_budget, dtype=np.float64)
+  scale = np.where(budget > 0, budget, 1.0)
+
+  # Fitting solutions of every bucket count met along the way, by segments
+  found = {}
+
+  # Whether the solution with k segments at the prices lam fits, and its resources
+  def fits(lam, k):
+    solutions = split_point_dp(costs, scale, lam, num_buckets)
+    for solution in solutions:
+      if solution is not None and np.all(solution[1] <= budget):
+        found[tuple(solution[2])] = solution[0]
+    if solutions[k - 1] is None:
+      return None, None
+    used = solutions[k - 1][1]
+    return bool(np.all(used <= budget)), used
+
+  # The price search is run for every bucket count, their relaxed optima take different paths
+  for k in range(1, num_buckets + 1):
+    low = np.zeros(4)
+    fitting, used = fits(low, k)
+    if fitting is None or fitting:
+      continue
+    # Prices start at a small share of the SSE range between the unconstrained and the cheapest histograms
+    cheapest_sse = split_point_dp(costs, scale, np.full(4, 1e18), num_buckets)[k - 1][0]
+    start = max(cheapest_sse - split_point_dp(costs, scale, low, num_buckets)[k - 1][0], 1.0) / 1024
+    high = low.copy()
+    for iteration in range(64):
+      high = np.where(used > budget, np.maximum(high * 2, start), high)
+      fitting, used = fits(high, k)
+      if fitting:
+        break
+      low = high.copy()
+    if fitting:
+      for iteration in range(iterations):
+        middle = (low + high) / 2
+        fitting, used = fits(middle, k)
+        if fitting:
+          high = middle
+        else:
+          low = middle
+
+  best = {'sse': float('inf'), 'segments': None}
+  for segments in sorted(found, key=found.get)[:upgrades]:
+    sse, used, segments = split_point_solution(costs, upgrade_segments(costs, segments, budget, scale))
+    if sse < best['sse']:
+      best['sse'] = sse
+      best['segments'] = segments
+
+  print(f"dp: {len(costs.points)} split points, runtime = {time.perf_counter() - start_time:.3f} s")
+  if best['segments'] is None:
+    print("Out of resources...")
+    return None
+
+  selected_buckets = []
+  for i, j, v in best['segments']:
+    type_id, size, args, resources = costs.variants[v]
+    low, high = int(costs.points[i]), int(costs.points[j])
+    bucket = BUCKET_TYPES[type_id](*args)
+    bucket.config(low, high)
+    values, counts = segment_counts(ground_truth_histo, min_val, low, high)
+    bucket.load_counts(values, counts)
+    selected_buckets.append(np.array([(type_id, size, low, high, rmse_of_bucket_counts(bucket, values, counts), *resources)], dtype=CANDIDATE_DTYPE)[0])
+  return selected_buckets
+
+# Column 1 of the file as int64 arrays of at most chunk_size rows, the first column (e.g. a date) is skipped
+def read_csv_chunks(file_path, chunk_size=100000):
+  with open(file_path, mode='r', encoding='utf-8-sig') as file:
+    while True:
+      lines = list(itertools.islice(file, chunk_size))
+      if not lines:
+        break
+      yield np.loadtxt(lines, delimiter=',', usecols=1, dtype=np.int64, ndmin=1)
+
+# Binary cache of a dataset, written next to its CSV: the samples as a memory-mappable .npy, the sparse ground truth
+# as a .npz and a JSON sidecar with min/max/n and the hash, size and mtime of the CSV it was converted from
+def dataset_cache_paths(file_path):
+  return file_path + '.samples.npy', file_path + '.histogram.npz', file_path + '.json'
+
+def file_hash(file_path):
+  digest = hashlib.sha1()
+  with open(file_path, mode='rb') as file:
+    for block in iter(lambda: file.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+def dataset_cache_is_fresh(file_path):
+  samples_path, histogram_path, info_path = dataset_cache_paths(file_path)
+  if not (os.path.exists(samples_path) and os.path.exists(histogram_path) and os.path.exists(info_path)):
+    return False
+  with open(info_path, mode='r', encoding='utf-8') as file:
+    info = json.load(file)
+  # The CSV is only hashed when its size is unchanged but it was touched since the conversion
+  stat = os.stat(file_path)
+  if info.get('source_size') != stat.st_size:
+    return False
+  if info.get('source_mtime_ns') == stat.st_mtime_ns:
+    return True
+  return info.get('source_hash') == file_hash(file_path)
+
+def convert_csv_file(file_path, chunk_size=100000):
+  samples_path, histogram_path, info_path = dataset_cache_paths(file_path)
+  stat = os.stat(file_path)
+  source_hash = file_hash(file_path)
+  ground_truth = read_ground_truth(file_path, chunk_size, use_cache=False)
+
+  samples = np.lib.format.open_memmap(samples_path, mode='w+', dtype=np.int64, shape=(ground_truth.total_count(),))
+  pos = 0
+  for chunk in read_csv_chunks(file_path, chunk_size):
+    samples[pos:pos + len(chunk)] = chunk
+    pos += len(chunk)
+  samples.flush()
+  del samples
+
+  np.savez(histogram_path, values=ground_truth.values, counts=ground_truth.counts, cumulative_counts=ground_truth.cumulative_counts)
+
+  # Written last, a conversion that did not complete is never considered fresh
+  with open(info_path, mode='w', encoding='utf-8') as file:
+    json.dump({
+      'source': os.path.basename(file_path),
+      'source_hash': source_hash,
+      'source_size': stat.st_size,
+      'source_mtime_ns': stat.st_mtime_ns,
+      'min': ground_truth.min,
+      'max': ground_truth.max,
+      'n': ground_truth.total_count(),
+      'distinct': ground_truth.num_distinct(),
+    }, file, indent=2)
+
+# Samples in stream order, memory-mapped from the dataset cache when it is fresh
+def read_samples(file_path, use_cache=True):
+  if use_cache and dataset_cache_is_fresh(file_path):
+    return np.load(dataset_cache_paths(file_path)[0], mmap_mode='r')
+  return np.concatenate([np.zeros(0, dtype=np.int64)] + list(read_csv_chunks(file_path)))
+
+def read_csv_file(file_path, use_cache=True):
+  return read_samples(file_path, use_cache).tolist()
+
+# Sparse ground truth of the file, the counts are accumulated chunk by chunk so that the samples are never all in memory
+def read_ground_truth(file_path, chunk_size=100000, use_cache=True):
+  if use_cache and dataset_cache_is_fresh(file_path):
+    with np.load(dataset_cache_paths(file_path)[1]) as histogram:
+      return SparseHistogram(histogram['values'], histogram['counts'], histogram['cumulative_counts'])
+
+  values = np.zeros(0, dtype=np.int64)
+  counts = np.zeros(0, dtype=np.int64)
+  for chunk in read_csv_chunks(file_path, chunk_size):
+    chunk_values, chunk_counts = np.unique(chunk, return_counts=True)
+    values, inverse = np.unique(np.concatenate((values, chunk_values)), return_inverse=True)
+    merged_counts = np.zeros(len(values), dtype=np.int64)
+    np.add.at(merged_counts, inverse, np.concatenate((counts, chunk_counts)))
+    counts = merged_counts
+  return SparseHistogram(values, counts)
 
 def compute_small_footprint_baseline(data, ground_truth_histo, num_buckets):
   buckets_config = histogram_configuration(data, ground_truth_histo, num_buckets, 'width')
 
-  min_data = min(data)
-  max_data = max(data)
+  min_data, max_data = ground_truth_bounds(data, ground_truth_histo)
   baseline_histo = HybridHistogram(min_data, max_data + 1)
 
   for config in buckets_config:
     low, high, stat = config
 
-    bucket = CoarseGrainedSimpleBucket.create_default_bucket('L')
+    bucket = CoarseGrainedSimpleBucket.create_default_bucket('S')
     bucket.config(low, high)
     baseline_histo.add_bucket(bucket)
-    
-    for sample in range(low, high):
-      ground_truth_count = ground_truth_histo[sample - min_data]
-
-      while ground_truth_count > 0:
-        baseline_histo.update(sample)
-        ground_truth_count -= 1
+    bucket.load_counts(*segment_counts(ground_truth_histo, min_data, low, high))
 
   return baseline_histo
 
 def compute_small_footprint_baseline_all(data_path, resource_budget, max_num_buckets):
   outputs_path = './Baselines/' + data_path.rsplit('/', 1)[-1] + '_baseline_small_footprint.csv'
-  data = read_csv_file(data_path)
-  ground_truth_histo = compute_per_value_histogram(data)
+  ground_truth_histo = read_ground_truth(data_path)
 
-  min_val = min(data)
-  # max_val = max(data)
+  min_val = ground_truth_histo.min
+  # max_val = ground_truth_histo.max
 
   with open(outputs_path, mode="w", encoding="utf-8") as file:
 
@@ -1084,7 +2617,7 @@ def compute_small_footprint_baseline_all(data_path, resource_budget, max_num_buc
     )
 
     for num_buckets in range(1, max_num_buckets + 1):
-      baseline = compute_small_footprint_baseline(data, ground_truth_histo, num_buckets)
+      baseline = compute_small_footprint_baseline(None, ground_truth_histo, num_buckets)
       err = rmse(baseline, ground_truth_histo)
       histo_res = baseline.get_resource_consumption()
 
@@ -1105,58 +2638,27 @@ def compute_small_footprint_baseline_all(data_path, resource_budget, max_num_buc
         buckets_str + "\n"
       )
 
-def compute_highest_accuracy_baseline_for_strategy(data, ground_truth_histo, num_buckets, split_strategy, min_data, max_data):
-  bucket_types = [CoarseGrainedSimpleBucket, CoarseGrainedDistinctBucket, CoarseGrainedBloomBucket, CoarseGrainedCountingBloomBucket, FineGrainedBucket]
-  sizes = ['S', 'M', 'L']
-  
-  ordered_candidate_buckets = []
-
+def compute_highest_accuracy_baseline_for_strategy(data, ground_truth_histo, num_buckets, split_strategy, min_data, max_data, cache=None, resource_budget=None):
   basline_histo = HybridHistogram(min_data, max_data + 1)
   buckets_config = histogram_configuration(data, ground_truth_histo, num_buckets, split_strategy)
   for config in buckets_config:
     low, high, stat = config
-
-    candidate_buckets = []
-
-    for bucket_type in bucket_types:
-      # if high - low < 50 and bucket_type == FineGrainedBucket or high - low < 50 and bucket_type == CoarseGrainedCountingBloomBucket:
-      #   continue
-
-      for size in sizes:
-        bucket = bucket_type.create_default_bucket(size)
-        bucket.config(low, high)
-
-        for sample in range(low, high):
-          ground_truth_count = ground_truth_histo[sample - min_data]
-
-          while ground_truth_count > 0:
-            bucket.update(sample)
-            ground_truth_count -= 1
-
-        err = rmse_of_bucket(bucket, ground_truth_histo, min_data)
-        LUT, FF, BRAM, DSP = bucket.get_resource_consumption()
-
-        candidate_buckets.append((bucket, err, LUT, FF, BRAM, DSP))
-
-    candidate_buckets.sort(key=lambda x: (x[1], x[2], x[3], x[4], x[5]))
-
-    ordered_candidate_buckets.append(candidate_buckets)
-
-  for candidate_list in ordered_candidate_buckets:
-    basline_histo.add_bucket(candidate_list[0][0])
+    candidates = evaluate_candidates(ground_truth_histo, min_data, low, high, cache, resource_budget)
+    basline_histo.add_bucket(build_candidate_bucket(candidates[0], ground_truth_histo, min_data))
   
   return basline_histo
 
-def compute_highest_accuracy_baselines_all(data_path, resource_budget, max_num_buckets):
+def compute_highest_accuracy_baselines_all(data_path, resource_budget, max_num_buckets, cache_path=None):
   outputs_path = './Baselines/' + data_path.rsplit('/', 1)[-1] + '_baseline_high_footprint_width.csv'
-  data = read_csv_file(data_path)
-  ground_truth_histo = compute_per_value_histogram(data)
+  ground_truth_histo = read_ground_truth(data_path)
 
   # split_strategies = ['depth-count', 'depth-distinct', 'width']
   split_strategies = ['width']
 
-  min_val = min(data)
-  max_val = max(data)
+  min_val = ground_truth_histo.min
+  max_val = ground_truth_histo.max
+
+  cache = CandidateCache(ground_truth_histo, min_val, db_path=cache_path)
 
   with open(outputs_path, mode="w", encoding="utf-8") as file:
     file.write(
@@ -1176,7 +2678,7 @@ def compute_highest_accuracy_baselines_all(data_path, resource_budget, max_num_b
     for split_strategy in split_strategies:
 
       for num_buckets in range(1, max_num_buckets + 1):
-        baseline = compute_highest_accuracy_baseline_for_strategy(data, ground_truth_histo, num_buckets, split_strategy, min_val, max_val)
+        baseline = compute_highest_accuracy_baseline_for_strategy(None, ground_truth_histo, num_buckets, split_strategy, min_val, max_val, cache, resource_budget)
         err = rmse(baseline, ground_truth_histo)
         histo_res = baseline.get_resource_consumption()
 
@@ -1200,13 +2702,14 @@ def compute_highest_accuracy_baselines_all(data_path, resource_budget, max_num_b
           buckets_str + "\n"
         )
 
+  cache.close()
+
 def one_bucket_fine_grained_baseline(data_path, resource_budget):
-  data = read_csv_file(data_path)
   outputs_path = './Baselines/' + data_path.rsplit('/', 1)[-1] + '_baseline_1_big_FG_bucket.csv'
-  ground_truth_histo = compute_per_value_histogram(data)
+  ground_truth_histo = read_ground_truth(data_path)
 
-  min_val = min(data)
-  max_val = max(data)
+  min_val = ground_truth_histo.min
+  max_val = ground_truth_histo.max
 
   baseline = HybridHistogram(min_val, max_val + 1)
   FG = FineGrainedBucket.create_default_bucket('XL')
@@ -1245,14 +2748,13 @@ def one_bucket_fine_grained_baseline(data_path, resource_budget):
     )
 
 def compute_multiple_fine_grained_basline(data_path, num_buckets, resource_budget):
-  data = read_csv_file(data_path)
   outputs_path = './Baselines/' + data_path.rsplit('/', 1)[-1] + '_baseline_multiple_FG_buckets.csv'
-  ground_truth_histo = compute_per_value_histogram(data)
+  ground_truth_histo = read_ground_truth(data_path)
 
-  buckets_config = histogram_configuration(data, ground_truth_histo, num_buckets, 'width')
+  buckets_config = histogram_configuration(None, ground_truth_histo, num_buckets, 'width')
 
-  min_val = min(data)
-  max_val = max(data)
+  min_val = ground_truth_histo.min
+  max_val = ground_truth_histo.max
 
   baseline_histo = HybridHistogram(min_val, max_val + 1)
 
@@ -1264,13 +2766,7 @@ def compute_multiple_fine_grained_basline(data_path, num_buckets, resource_budge
     print(bucket.get_resource_consumption())
     bucket.config(low, high)
     baseline_histo.add_bucket(bucket)
-    
-    for sample in range(low, high):
-      ground_truth_count = ground_truth_histo[sample - min_val]
-
-      while ground_truth_count > 0:
-        baseline_histo.update(sample)
-        ground_truth_count -= 1
+    bucket.load_counts(*segment_counts(ground_truth_histo, min_val, low, high))
 
   with open(outputs_path, mode="w", encoding="utf-8") as file:
 
@@ -1305,269 +2801,479 @@ def compute_multiple_fine_grained_basline(data_path, num_buckets, resource_budge
       buckets_str + "\n"
     )
 
-def run(data_path, resource_budget, num_buckets, algorithm, split_strategy):
-  data = read_csv_file(data_path)
-  ground_truth_histo = compute_per_value_histogram(data)
+def run(data_path, resource_budget, num_buckets, algorithm, split_strategy, clock_mhz=100, target_rate=None):
+  ground_truth_histo = read_ground_truth(data_path)
+  samples = read_samples(data_path)
 
-  min_val = min(data)
-  max_val = max(data)
+  min_val = ground_truth_histo.min
+  max_val = ground_truth_histo.max
   print(min_val, max_val)
 
 
-  candidate_buckets = construct_candidates(data, ground_truth_histo, resource_budget, num_buckets, split_strategy, False)
-  candidate_buckets.sort(key=lambda candidates: (candidates[0][0].high - candidates[0][0].low))
-
-  # for c in candidate_buckets:
-  #   print(c[0][0].low, c[0][0].high)
-
-  selected_buckets = algorithm(candidate_buckets, resource_budget)
-  selected_buckets.sort(key=lambda selected: (selected[0].low))
+  # The split point optimizer chooses the boundaries and the buckets together, algorithm is not used
+  if split_strategy == 'v-optimal':
+    max_interval = None if target_rate is None else clock_mhz * 1e6 / target_rate
+    selected_buckets = dp_histogram(SplitPointCosts(ground_truth_histo, min_val, resource_budget, max_interval=max_interval), ground_truth_histo, min_val, resource_budget, num_buckets)
+  else:
+    candidate_buckets = construct_candidates(None, ground_truth_histo, resource_budget, num_buckets, split_strategy, False)
+    # Before the Pareto filter, a candidate dominated by one that is too slow must stay available
+    if target_rate is not None:
+      candidate_buckets, removed = ingest_rate_filter_candidates(candidate_buckets, samples, clock_mhz, target_rate)
+      print(f"Ingest rate filter removed {removed} candidates")
+      if any(len(candidates) == 0 for candidates in candidate_buckets):
+        print("No bucket of a segment reaches the target ingest rate...")
+        return
+    candidate_buckets, removed = pareto_filter_candidates(candidate_buckets)
+    print(f"Pareto filter removed {removed} candidates")
+    candidate_buckets.sort(key=lambda candidates: (candidates['high'][0] - candidates['low'][0]))
+
+    # for c in candidate_buckets:
+    #   print(c['low'][0], c['high'][0])
+
+    selected_buckets = algorithm(candidate_buckets, resource_budget)
 
   if selected_buckets is None:
     print("Out of resources...")
     return
 
-  print("Selected Buckets: ")
-  for bucket in selected_buckets:
-    print(bucket[0].low, bucket[0].high, bucket)
+  rate = selection_ingest_rate(selected_buckets, samples, clock_mhz)
+  print(f"Ingest rate: {rate:.0f} samples/s at {clock_mhz} MHz")
+  if target_rate is not None and rate < target_rate:
+    print("Misses the target ingest rate...")
+    return
 
-  histo = HybridHistogram(min_val, max_val + 1)
-  for b in selected_buckets:
-    histo.add_bucket(b[0])
+  histo = build_histogram(selected_buckets, ground_truth_histo, min_val, max_val)
+
+  print("Selected Buckets: ")
+  for bucket, candidate in zip(histo.buckets, selected_buckets):
+    print(bucket.low, bucket.high, type(bucket).__name__, BUCKET_SIZES[candidate['size']], candidate)
 
   err = rmse(histo, ground_truth_histo)
   print(err)
   print(rmse_per_bucket(histo, ground_truth_histo))
   plot_histogram(histo, ground_truth_histo, min_val)
 
-def run_all(data_path, outputs_path, resource_budget, max_num_buckets):
-  data = read_csv_file(data_path)
-  ground_truth_histo = compute_per_value_histogram(data)
-
-  min_val = min(data)
-  max_val = max(data)
-  print(min_val, max_val)
-
-  with open(outputs_path, mode="w", encoding="utf-8") as file:
-
-    file.write(
-      "max # buckets" + "," +
-      "actual # buckets" + "," +
-      "ground truth split strategy" + "," +
-      "algorithm" + "_" + "[first solution construction]" + "," +
-      "overall err" + "," +
-      "weighted res. consumption" + "," +
-      "latency (cycles)" + "," +
-      "LUTs (%)" + "," +
-      "FFs (%)" + "," +
-      "BRAM (%)" + "," +
-      "DSPs (%)" + "," +
-      "(bucket type : per bucket err)" + "\n"
-    )
-
-    for num_buckets in range(3, max_num_buckets + 1):
-      print(f"num buckets = {num_buckets}")
-      for split_strategy in ['depth-count', 'depth-distinct', 'width']:
-        candidate_buckets = construct_candidates(data, ground_truth_histo, resource_budget, num_buckets, split_strategy, True)
-        if candidate_buckets == []:
-          continue
-
-        candidate_buckets.sort(key=lambda candidates: (candidates[0][0].high - candidates[0][0].low))
-
-        for algorithm in [greedy_min_error_histogram, greedy_avg_res_histogram, simulated_annealing_histogram]:
-
-          # for c in candidate_buckets:
-          #   print(c[0][0].low, c[0][0].high)
-
-          if algorithm == simulated_annealing_histogram:
-            for first_sol in ['first', 'middle', 'last', 'random']:
-              selected_buckets = algorithm(candidate_buckets, resource_budget, first_sol)
-
-              if selected_buckets is None:
-                print("Out of resources...")
-              else:
-                selected_buckets.sort(key=lambda selected: (selected[0].low))
-                histo = HybridHistogram(min_val, max_val + 1)
-                for b in selected_buckets:
-                  histo.add_bucket(b[0])
-
-                err = rmse(histo, ground_truth_histo)
-                histo_res = histo.get_resource_consumption()
-
-                buckets_str = ''
-                for b in selected_buckets:
-                  buckets_str += '(' + str(type(b[0])) + ' : ' + str(rmse_of_bucket(b[0], ground_truth_histo, min_val)) + ') '
-
-                file.write(
-                  str(num_buckets) + "," +
-                  str(len(selected_buckets)) + "," +
-                  split_strategy + "," +
-                  algorithm.__name__ + "_" + first_sol + "," +
-                  str(err) + "," +
-                  str(histo.weighted_resource_usage(resource_budget)) + "," +
-                  str(histo.get_latency()) + "," +
-                  str(histo_res[0] / resource_budget[0] * 100) + "," +
-                  str(histo_res[1] / resource_budget[1] * 100) + "," +
-                  str(histo_res[2] / resource_budget[2] * 100) + "," +
-                  str(histo_res[3] / resource_budget[3] * 100) + "," +
-                  buckets_str + "\n"
-                )
-
-          else:
-            selected_buckets = algorithm(candidate_buckets, resource_budget)
-
-            if selected_buckets is None:
-              print("Out of resources...")
-            else:
-              selected_buckets.sort(key=lambda selected: (selected[0].low))
-              histo = HybridHistogram(min_val, max_val + 1)
-              for b in selected_buckets:
-                histo.add_bucket(b[0])
-
-              err = rmse(histo, ground_truth_histo)
-              histo_res = histo.get_resource_consumption()
-
-              buckets_str = ''
-              for b in selected_buckets:
-                buckets_str += '(' + str(type(b[0])) + ' : ' + str(rmse_of_bucket(b[0], ground_truth_histo, min_val)) + ') '
-
-              file.write(
-                str(num_buckets) + "," +
-                str(len(selected_buckets)) + "," +
-                split_strategy + "," +
-                algorithm.__name__ + "," +
-                str(err) + "," +
-                str(histo.weighted_resource_usage(resource_budget)) + "," +
-                str(histo.get_latency()) + "," +
-                str(histo_res[0] / resource_budget[0] * 100) + "," +
-                str(histo_res[1] / resource_budget[1] * 100) + "," +
-                str(histo_res[2] / resource_budget[2] * 100) + "," +
-                str(histo_res[3] / resource_budget[3] * 100) + "," +
-                buckets_str + "\n"
-              )
-
 from concurrent.futures import ProcessPoolExecutor, as_completed
-
-def process_combination(num_buckets, split_strategy, data, ground_truth_histo, resource_budget, min_val, max_val):
-    results = []
-    candidate_buckets = construct_candidates(data, ground_truth_histo, resource_budget, num_buckets, split_strategy, True)
-    if not candidate_buckets:
-        return results
-
-    candidate_buckets.sort(key=lambda candidates: (candidates[0][0].high - candidates[0][0].low))
-
-    for algorithm in [greedy_min_error_histogram, greedy_avg_res_histogram, simulated_annealing_histogram]:
-        if algorithm == simulated_annealing_histogram:
-            for first_sol in ['first', 'middle', 'last', 'random']:
-                selected_buckets = algorithm(candidate_buckets, resource_budget, first_sol)
-                if selected_buckets:
-                    results.append(process_selected_buckets(
-                        num_buckets, split_strategy, f"{algorithm.__name__}_{first_sol}",
-                        selected_buckets, ground_truth_histo, min_val, max_val, resource_budget))
-        else:
-            selected_buckets = algorithm(candidate_buckets, resource_budget)
-            if selected_buckets:
-                results.append(process_selected_buckets(
-                    num_buckets, split_strategy, algorithm.__name__,
-                    selected_buckets, ground_truth_histo, min_val, max_val, resource_budget))
-    return results
-
-def process_selected_buckets(num_buckets, split_strategy, algorithm_name, selected_buckets, ground_truth_histo, min_val, max_val, resource_budget):
-    selected_buckets.sort(key=lambda selected: (selected[0].low))
-    histo = HybridHistogram(min_val, max_val + 1)
-    for b in selected_buckets:
-        histo.add_bucket(b[0])
-
+from multiprocessing import shared_memory
+
+# 'v-optimal' is not a split of histogram_configuration: dp_histogram chooses the boundaries together with the buckets
+SPLIT_STRATEGIES = ['depth-count', 'depth-distinct', 'width', 'v-optimal']
+
+SWEEP_HEADER = (
+    "max # buckets,actual # buckets,ground truth split strategy,algorithm_[first solution construction],"
+    "overall err,weighted res. consumption,latency (cycles),LUTs (%),FFs (%),BRAM (%),DSPs (%),(bucket type : per bucket err)\n"
+)
+
+# Dataset and settings of a sweep. The pool initializer sets them once per worker process instead of pickling the
+# ground truth into every task.
+sweep_state = {}
+
+def init_sweep_worker(ground_truth_histo, resource_budget, cache_path, samples=None, clock_mhz=100, target_rate=None):
+    sweep_state['ground_truth_histo'] = ground_truth_histo
+    sweep_state['resource_budget'] = resource_budget
+    sweep_state['cache'] = CandidateCache(ground_truth_histo, ground_truth_histo.min, db_path=cache_path)
+    # The ingest rate depends on the order of the samples, not only on the ground truth
+    sweep_state['clock_mhz'] = clock_mhz
+    sweep_state['target_rate'] = target_rate
+    sweep_state['samples'] = samples
+    sweep_state['candidate_rates'] = {}
+
+# Copies the arrays into shared memory blocks, returns the blocks (to be unlinked by the owner) and the descriptors
+# workers attach to
+def share_arrays(arrays):
+    blocks = []
+    descriptors = []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        descriptors.append((block.name, array.shape, array.dtype.str))
+    return blocks, descriptors
+
+# Zero-copy views of shared arrays, the blocks must be kept alive as long as the views are used
+def attach_shared_arrays(descriptors):
+    blocks = [shared_memory.SharedMemory(name=name) for name, shape, dtype in descriptors]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (name, shape, dtype) in zip(blocks, descriptors)]
+    return blocks, arrays
+
+# Pool initializer: the ground truth arrays and the samples (with a target rate) are attached from shared memory instead
+# of being read or copied into every worker
+def init_shared_sweep_worker(descriptors, resource_budget, cache_path, clock_mhz=100, target_rate=None, registry=None):
+    # Candidate indices of the tasks refer to the registry of the parent
+    if registry is not None:
+        state, parent_hash = registry
+        apply_registry_state(state)
+        if registry_hash() != parent_hash:
+            raise RuntimeError(f"Sweep worker registry {registry_hash()} differs from the parent registry {parent_hash}")
+    blocks, (values, counts, cumulative_counts, *samples) = attach_shared_arrays(descriptors)
+    sweep_state['shared_blocks'] = blocks
+    init_sweep_worker(SparseHistogram(values, counts, cumulative_counts), resource_budget, cache_path, samples[0] if samples else None, clock_mhz, target_rate)
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def shared_sweep_task(num_buckets, split_strategy, done=()):
+    return sweep_task(num_buckets, split_strategy, done), os.getpid(), peak_rss_mb()
+
+# Output row of a selected histogram and its RMSE
+def sweep_row(num_buckets, split_strategy, algorithm_name, selected_buckets):
+    ground_truth_histo = sweep_state['ground_truth_histo']
+    resource_budget = sweep_state['resource_budget']
+
+    histo = build_histogram(selected_buckets, ground_truth_histo, ground_truth_histo.min, ground_truth_histo.max)
     err = rmse(histo, ground_truth_histo)
     histo_res = histo.get_resource_consumption()
-    buckets_str = ' '.join(
-        f"({type(b[0])} : {rmse_of_bucket(b[0], ground_truth_histo, min_val)})"
-        for b in selected_buckets
-    )
-    return (
-        num_buckets, len(selected_buckets), split_strategy, algorithm_name,
-        err, histo.weighted_resource_usage(resource_budget), histo.get_latency(),
-        histo_res[0] / resource_budget[0] * 100, histo_res[1] / resource_budget[1] * 100,
-        histo_res[2] / resource_budget[2] * 100, histo_res[3] / resource_budget[3] * 100, buckets_str
-    )
 
-def run_all_parallel(data_path, outputs_path, resource_budget, max_num_buckets):
-    data = read_csv_file(data_path)
-    ground_truth_histo = compute_per_value_histogram(data)
-    min_val, max_val = min(data), max(data)
-
-    with open(outputs_path, mode="w", encoding="utf-8") as file:
-        file.write(
-            "max # buckets,actual # buckets,ground truth split strategy,algorithm,"
-            "overall err,weighted res. consumption,latency (cycles),LUTs (%),FFs (%),BRAM (%),DSPs (%),(bucket type : per bucket err)\n"
-        )
-
-        tasks = []
-        with ProcessPoolExecutor() as executor:
-            for num_buckets in range(1, max_num_buckets + 1):
-                for split_strategy in ['depth-count', 'depth-distinct', 'width']:
-                    tasks.append(executor.submit(process_combination, num_buckets, split_strategy, data, ground_truth_histo, resource_budget, min_val, max_val))
-
-            for future in as_completed(tasks):
-                for result in future.result():
-                    file.write(','.join(map(str, result)) + '\n')
-
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from itertools import product
+    row = (
+        str(num_buckets) + "," +
+        str(len(selected_buckets)) + "," +
+        split_strategy + "," +
+        algorithm_name + "," +
+        str(err) + "," +
+        str(histo.weighted_resource_usage(resource_budget)) + "," +
+        str(histo.get_latency()) + "," +
+        str(histo_res[0] / resource_budget[0] * 100) + "," +
+        str(histo_res[1] / resource_budget[1] * 100) + "," +
+        str(histo_res[2] / resource_budget[2] * 100) + "," +
+        str(histo_res[3] / resource_budget[3] * 100) + "," +
+        selected_buckets_info(histo, selected_buckets) + "\n"
+    )
+    return row, err
+
+# (algorithm, first solution construction) of every row of a sweep task
+SWEEP_RUNS = (
+    [(greedy_min_error_histogram, None), (greedy_avg_res_histogram, None)] +
+    [(simulated_annealing_histogram, first_sol) for first_sol in ['first', 'middle', 'last', 'random']] +
+    [(knapsack_histogram, None)]
+)
+
+def sweep_runs(split_strategy):
+    if split_strategy == 'v-optimal':
+        return [(dp_histogram, None)]
+    return SWEEP_RUNS
+
+def sweep_keys(num_buckets, split_strategy):
+    return [(num_buckets, split_strategy, algorithm.__name__, first_sol) for algorithm, first_sol in sweep_runs(split_strategy)]
+
+# (key, output row, RMSE) of a selection, the row and RMSE are None when it is over the budget or too slow
+def sweep_result(key, algorithm_name, selected_buckets):
+    num_buckets, split_strategy = key[:2]
+    target_rate = sweep_state['target_rate']
+    if selected_buckets is None:
+        print("Out of resources...")
+        return (key, None, None)
+    if target_rate is not None and selection_ingest_rate(selected_buckets, sweep_state['samples'], sweep_state['clock_mhz']) < target_rate:
+        print("Misses the target ingest rate...")
+        return (key, None, None)
+    return (key, *sweep_row(num_buckets, split_strategy, algorithm_name, selected_buckets))
+
+# The split point costs only depend on the dataset and the budget, they are computed once per process
+def split_point_sweep_task(num_buckets, done=()):
+    key = (num_buckets, 'v-optimal', dp_histogram.__name__, None)
+    if key in done:
+        return []
+    ground_truth_histo = sweep_state['ground_truth_histo']
+    if 'split_point_costs' not in sweep_state:
+        target_rate = sweep_state['target_rate']
+        max_interval = None if target_rate is None else sweep_state['clock_mhz'] * 1e6 / target_rate
+        sweep_state['split_point_costs'] = SplitPointCosts(ground_truth_histo, ground_truth_histo.min, sweep_state['resource_budget'], max_interval=max_interval)
+    selected_buckets = dp_histogram(sweep_state['split_point_costs'], ground_truth_histo, ground_truth_histo.min, sweep_state['resource_budget'], num_buckets)
+    return [sweep_result(key, dp_histogram.__name__, selected_buckets)]
+
+# (key, output row, RMSE) of the selection algorithms of one (bucket count, split strategy) whose key is not in done,
+# the row and RMSE are None when no histogram fits in the budget
+def sweep_task(num_buckets, split_strategy, done=()):
+    if split_strategy == 'v-optimal':
+        return split_point_sweep_task(num_buckets, done)
+
+    ground_truth_histo = sweep_state['ground_truth_histo']
+    resource_budget = sweep_state['resource_budget']
+
+    runs = [(algorithm, first_sol) for algorithm, first_sol in SWEEP_RUNS if (num_buckets, split_strategy, algorithm.__name__, first_sol) not in done]
 
-def process_task_group(task_group, data, ground_truth_histo, resource_budget, min_val, max_val):
     results = []
-    for num_buckets, split_strategy in task_group:
-        print(num_buckets)
-        results.extend(process_combination(
-            num_buckets, split_strategy, data, ground_truth_histo,
-            resource_budget, min_val, max_val
-        ))
-    return results
-
-def run_all_parallel2(data_path, outputs_path, resource_budget, max_num_buckets, chunk_size=15):
-    data = read_csv_file(data_path)
-    ground_truth_histo = compute_per_value_histogram(data)
-    min_val, max_val = min(data), max(data)
+    candidate_buckets = construct_candidates(None, ground_truth_histo, resource_budget, num_buckets, split_strategy, True, sweep_state['cache'])
+    if candidate_buckets == []:
+        return [((num_buckets, split_strategy, algorithm.__name__, first_sol), None, None) for algorithm, first_sol in runs]
+
+    # Before the Pareto filter, a candidate dominated by one that is too slow must stay available
+    target_rate = sweep_state['target_rate']
+    if target_rate is not None:
+        candidate_buckets, removed = ingest_rate_filter_candidates(candidate_buckets, sweep_state['samples'], sweep_state['clock_mhz'], target_rate, sweep_state['candidate_rates'])
+        print(f"{num_buckets} buckets, {split_strategy}: ingest rate filter removed {removed} candidates")
+        if any(len(candidates) == 0 for candidates in candidate_buckets):
+            return [((num_buckets, split_strategy, algorithm.__name__, first_sol), None, None) for algorithm, first_sol in runs]
+    candidate_buckets, removed = pareto_filter_candidates(candidate_buckets)
+    print(f"{num_buckets} buckets, {split_strategy}: Pareto filter removed {removed} candidates")
+    candidate_buckets.sort(key=lambda candidates: (candidates['high'][0] - candidates['low'][0]))
+
+    for algorithm, first_sol in runs:
+        key = (num_buckets, split_strategy, algorithm.__name__, first_sol)
+        if first_sol is None:
+            selected_buckets = algorithm(candidate_buckets, resource_budget)
+            algorithm_name = algorithm.__name__
+        else:
+            selected_buckets = algorithm(candidate_buckets, resource_budget, first_sol)
+            algorithm_name = algorithm.__name__ + "_" + first_sol
 
-    all_tasks = list(product(range(1, max_num_buckets + 1), ['depth-count', 'depth-distinct', 'width']))
-    chunks = [all_tasks[i:i + chunk_size] for i in range(0, len(all_tasks), chunk_size)]
+        results.append(sweep_result(key, algorithm_name, selected_buckets))
+    return results
 
-    results = []
-    with ProcessPoolExecutor() as executor:
-        futures = [executor.submit(process_task_group, chunk, data, ground_truth_histo, resource_budget, min_val, max_val)
-                   for chunk in chunks]
+# A checkpoint is only valid for the ground truth, budget and sweep settings it was written for
+def sweep_config_hash(ground_truth_histo, resource_budget, clock_mhz=100, target_rate=None):
+    digest = hashlib.sha1()
+    digest.update(dataset_hash(ground_truth_histo, ground_truth_histo.min).encode())
+    digest.update(json.dumps([list(resource_budget), SPLIT_STRATEGIES, [sweep_keys(0, split_strategy) for split_strategy in SPLIT_STRATEGIES]]).encode())
+    digest.update(registry_hash().encode())
+    if target_rate is not None:
+        digest.update(json.dumps([clock_mhz, target_rate]).encode())
+    return digest.hexdigest()
+
+# Checkpoint: a JSON line with the config hash, then one JSON line per completed (num_buckets, split_strategy,
+# algorithm, first_sol) key followed by its RMSE. Returns the config hash and the RMSE of every completed key.
+def read_checkpoint(checkpoint_path):
+    config_hash = None
+    done = {}
+    with open(checkpoint_path, mode='r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict):
+                config_hash = entry.get('config_hash')
+            else:
+                done[tuple(entry[:4])] = entry[4] if len(entry) > 4 else None
+    return config_hash, done
+
+# Drops an incomplete last line left by an interrupted write
+def truncate_partial_line(path):
+    with open(path, mode='rb+') as file:
+        content = file.read()
+        if content and not content.endswith(b'\n'):
+            file.truncate(content.rfind(b'\n') + 1)
+
+# Rows go to the output before their keys go to the checkpoint, so that a key is never recorded for a lost row
+def write_sweep_results(file, checkpoint, results):
+    for key, row, err in results:
+        if row is not None:
+            file.write(row)
+    file.flush()
+    for key, row, err in results:
+        checkpoint.write(json.dumps([*key, err]) + '\n')
+    checkpoint.flush()
+
+# Runs the tasks of the given bucket counts that are not done yet, in the pool when there is one, and writes their
+# results. Returns the best RMSE of every bucket count, None when no histogram fits in the budget.
+def run_sweep_levels(levels, done, executor, ordered, file, checkpoint, worker_rss):
+    tasks = []
+    level_errors = {num_buckets: [] for num_buckets in levels}
+    for num_buckets in levels:
+        for split_strategy in SPLIT_STRATEGIES:
+            task_done = [key for key in sweep_keys(num_buckets, split_strategy) if key in done]
+            level_errors[num_buckets] += [done[key] for key in task_done]
+            if len(task_done) < len(sweep_runs(split_strategy)):
+                tasks.append((num_buckets, split_strategy, set(task_done)))
+
+    def record(results):
+        write_sweep_results(file, checkpoint, results)
+        for key, row, err in results:
+            level_errors[key[0]].append(err)
+
+    if executor is None:
+        for task in tasks:
+            record(sweep_task(*task))
+    else:
+        futures = {}
+        for index in sorted(range(len(tasks)), key=lambda index: -tasks[index][0]):
+            futures[executor.submit(shared_sweep_task, *tasks[index])] = index
 
+        finished = {}
+        next_index = 0
         for future in as_completed(futures):
-            results.extend(future.result())
-
-    with open(outputs_path, mode="w", encoding="utf-8") as file:
-        file.write(
-            "max # buckets,actual # buckets,ground truth split strategy,algorithm,"
-            "overall err,weighted res. consumption,latency (cycles),LUTs (%),FFs (%),BRAM (%),DSPs (%),(bucket type : per bucket err)\n"
-        )
-        for result in results:
-            file.write(','.join(map(str, result)) + '\n')
-
-with open("config.yaml", "r") as f:
-    cfg = yaml.safe_load(f)
-
-data_file = cfg["data_path"]
-platform = cfg["platform"]
-outputs_file = cfg.get("outputs_path", "./Outputs/results.csv")
-budgets = cfg["budgets"]
-
-# Rice rule for determining the optimal number of buckets in a histogram
-n = len(read_csv_file(data_file))
-k = math.ceil(2 * (n ** (1 / 3)))
-print(f"k = {k}")
-
-max_buckets = cfg.get("max_buckets", k)
-
-if platform not in budgets:
-    raise ValueError(f"Unknown platform '{platform}' in config")
-budget = tuple(budgets[platform]) 
+            results, pid, rss = future.result()
+            worker_rss[pid] = rss
+            if not ordered:
+                record(results)
+                continue
+
+            finished[futures[future]] = results
+            while next_index in finished:
+                record(finished.pop(next_index))
+                next_index += 1
+
+    return {num_buckets: min((err for err in errors if err is not None), default=None) for num_buckets, errors in level_errors.items()}
+
+# Bucket counts of the coarse pass of the coarse-to-fine search: 3, 6, 12, ... and max_num_buckets
+def geometric_levels(max_num_buckets, factor=2):
+    levels = []
+    num_buckets = 3
+    while num_buckets < max_num_buckets:
+        levels.append(num_buckets)
+        num_buckets *= factor
+    levels.append(max_num_buckets)
+    return levels
+
+# Explores 3..max_num_buckets buckets for every split strategy and writes one row per selected histogram.
+# With num_workers > 1 the tasks run in a process pool, the most expensive ones (highest bucket counts) first, and rows
+# are streamed to the output as tasks finish; ordered=True keeps the serial row order by holding back rows that
+# finish early. num_workers=None uses one worker per CPU.
+# Completed keys are recorded in outputs_path + '.checkpoint'. With resume=True an existing checkpoint of the same
+# dataset and budget is continued: finished work is skipped and rows are appended to the existing output.
+# search selects the explored bucket counts:
+#   'full'           every bucket count
+#   'early-stop'     increasing bucket counts until the best RMSE has not improved by more than tolerance (relative)
+#                    for patience bucket counts, or until no histogram fits in the budget
+#   'coarse-to-fine' the geometric bucket counts 3, 6, 12, ..., then every bucket count between the neighbours of the
+#                    best one
+# With a target_rate (samples per second) the histograms that cannot ingest the dataset's sample stream at that rate
+# with a clock of clock_mhz are rejected like the ones over the budget.
+def run_all(data_path, outputs_path, resource_budget, max_num_buckets, cache_path=None, num_workers=1, ordered=True, resume=False,
+            search='full', tolerance=0.01, patience=2, clock_mhz=100, target_rate=None):
+    if search not in ('full', 'early-stop', 'coarse-to-fine'):
+        raise ValueError(f"Unknown search mode '{search}'")
+
+    ground_truth_histo = read_ground_truth(data_path)
+    print(ground_truth_histo.min, ground_truth_histo.max)
+
+    checkpoint_path = outputs_path + '.checkpoint'
+    config_hash = sweep_config_hash(ground_truth_histo, resource_budget, clock_mhz, target_rate)
+    resuming = resume and os.path.exists(checkpoint_path) and os.path.exists(outputs_path)
+    done = {}
+    if resuming:
+        checkpoint_hash, done = read_checkpoint(checkpoint_path)
+        if checkpoint_hash != config_hash:
+            raise ValueError(f"Checkpoint '{checkpoint_path}' was written for a different dataset or budget")
+        truncate_partial_line(outputs_path)
+        truncate_partial_line(checkpoint_path)
+        print(f"resuming from {checkpoint_path}: {len(done)} results already done")
+
+    mode = "a" if resuming else "w"
+    with open(outputs_path, mode=mode, encoding="utf-8") as file, open(checkpoint_path, mode=mode, encoding="utf-8") as checkpoint:
+        if not resuming:
+            file.write(SWEEP_HEADER)
+            checkpoint.write(json.dumps({'config_hash': config_hash}) + '\n')
+
+        executor = None
+        blocks = []
+        worker_rss = {}
+        # Read once, the workers attach to them
+        samples = read_samples(data_path) if target_rate is not None else None
+        if num_workers == 1:
+            init_sweep_worker(ground_truth_histo, resource_budget, cache_path, samples, clock_mhz, target_rate)
+        else:
+            shared = [ground_truth_histo.values, ground_truth_histo.counts, ground_truth_histo.cumulative_counts]
+            blocks, descriptors = share_arrays(shared + ([samples] if samples is not None else []))
+            executor = ProcessPoolExecutor(max_workers=num_workers, initializer=init_shared_sweep_worker, initargs=(descriptors, resource_budget, cache_path, clock_mhz, target_rate, (registry_state(), registry_hash())))
+
+        try:
+            def run_levels(levels):
+                return run_sweep_levels(levels, done, executor, ordered, file, checkpoint, worker_rss)
+
+            if search == 'full':
+                run_levels(range(3, max_num_buckets + 1))
+
+            elif search == 'early-stop':
+                # Bucket counts are evaluated in rounds that keep all the workers busy
+                round_size = 1 if executor is None else max(1, (num_workers or os.cpu_count() or 1) // len(SPLIT_STRATEGIES))
+                best_err = None
+                stale = 0
+                for first in range(3, max_num_buckets + 1, round_size):
+                    best_per_level = run_levels(range(first, min(first + round_size, max_num_buckets + 1)))
+                    stop = False
+                    for num_buckets, err in sorted(best_per_level.items()):
+                        if err is None:
+                            print(f"no histogram with {num_buckets} buckets fits in the budget, stopping")
+                            stop = True
+                            break
+                        if best_err is None or best_err - err > tolerance * best_err:
+                            stale = 0
+                        else:
+                            stale += 1
+                        best_err = err if best_err is None else min(best_err, err)
+                        if stale >= patience:
+                            print(f"best RMSE {best_err} has not improved for {patience} bucket counts, stopping at {num_buckets} buckets")
+                            stop = True
+                            break
+                    if stop:
+                        break
 
-run_all(data_file, outputs_file, budget, max_buckets)
-compute_small_footprint_baseline_all(data_file, budget, max_buckets)
-compute_highest_accuracy_baselines_all(data_file, budget, max_buckets)
\ No newline at end of file
+            else:
+                levels = geometric_levels(max_num_buckets)
+                best_per_level = run_levels(levels)
+                fitting = [num_buckets for num_buckets in levels if best_per_level[num_buckets] is not None]
+                if fitting:
+                    best = min(fitting, key=lambda num_buckets: best_per_level[num_buckets])
+                    position = levels.index(best)
+                    low = levels[max(position - 1, 0)]
+                    high = levels[min(position + 1, len(levels) - 1)]
+                    print(f"coarse pass: best RMSE {best_per_level[best]} with {best} buckets, refining {low}..{high}")
+                    run_levels([num_buckets for num_buckets in range(low, high + 1) if num_buckets not in best_per_level])
+        finally:
+            if executor is None:
+                cache = sweep_state['cache']
+                print(f"candidate cache: {cache.hits} hits, {cache.misses} misses")
+                cache.close()
+            else:
+                executor.shutdown()
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    if executor is not None:
+        print(f"main process: peak RSS {peak_rss_mb():.1f} MB")
+        for pid, rss in sorted(worker_rss.items()):
+            print(f"worker {pid}: peak RSS {rss:.1f} MB")
+
+if __name__ == "__main__":
+    with open("config.yaml", "r") as f:
+        cfg = yaml.safe_load(f)
+
+    data_file = cfg["data_path"]
+    platform = cfg["platform"]
+    outputs_file = cfg.get("outputs_path", "./Outputs/results.csv")
+    budgets = cfg["budgets"]
+
+    if cfg.get("dataset_cache", True) and not dataset_cache_is_fresh(data_file):
+        convert_csv_file(data_file)
+
+    # Rice rule for determining the optimal number of buckets in a histogram
+    n = read_ground_truth(data_file).total_count()
+    k = math.ceil(2 * (n ** (1 / 3)))
+    print(f"k = {k}")
+
+    max_buckets = cfg.get("max_buckets", k)
+    cache_file = cfg.get("cache_path")
+    workers = cfg.get("workers", 1)
+    ordered = cfg.get("ordered_output", True)
+    resume = cfg.get("resume", False)
+    search = cfg.get("search", "full")
+    clock_mhz = cfg.get("clock_mhz", 100)
+    target_rate = cfg.get("target_ingest_rate")
+
+    if platform not in budgets:
+        raise ValueError(f"Unknown platform '{platform}' in config")
+
+    # Resource model fitted on the registered variants and the given utilization reports, used to add variants at
+    # arbitrary generics to the explored ones
+    resource_model_cfg = cfg.get("resource_model") or {}
+    if resource_model_cfg.get("reports") or resource_model_cfg.get("variants"):
+        reports = [(report["path"], {bucket_type_by_name(name): args for name, args in report.get("arguments", {}).items()},
+                    [(bucket_type_by_name(name), args, count) for name, args, count in report.get("buckets", [])])
+                   for report in resource_model_cfg.get("reports", [])]
+        calibrate_resource_model(reports)
+        for name, arguments in resource_model_cfg.get("variants", {}).items():
+            register_model_variants(bucket_type_by_name(name), arguments)
+    if resource_model_cfg.get("generic_space"):
+        register_generic_space(budgets.values())
+    budget = tuple(budgets[platform])
+
+    run_all(data_file, outputs_file, budget, max_buckets, cache_file, workers, ordered, resume, search, clock_mhz=clock_mhz, target_rate=target_rate)
+    compute_small_footprint_baseline_all(data_file, budget, max_buckets)
+    compute_highest_accuracy_baselines_all(data_file, budget, max_buckets, cache_file)